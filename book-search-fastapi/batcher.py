@@ -0,0 +1,68 @@
+import asyncio
+import logging
+
+class BatchLoader:
+    '''Collects the keys asked for by every caller in the process within a short window, and loads them all with
+       a single call to batch_fn, DataLoader-style.  batch_fn takes a list of keys and returns a dict of key -> value;
+       keys missing from that dict resolve to None.'''
+
+    def __init__(self, batch_fn, window: float, max_batch_size: int):
+        self.batch_fn = batch_fn
+        self.window = window                  # seconds to wait for more keys after the first one arrives
+        self.max_batch_size = max_batch_size  # flush early once this many keys are waiting
+        self._pending = {}                    # key -> future shared by everyone waiting on that key
+        self._flush_handle = None
+        self._dispatches = set()              # references to in-flight batches, so they aren't garbage collected
+        self.batches = 0
+        self.keys_requested = 0
+        self.keys_loaded = 0
+
+    async def load(self, key):
+        if key is None:
+            return None
+        self.keys_requested += 1
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending[key] = future
+            if len(self._pending) >= self.max_batch_size:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.window, self._flush)
+        # shielded, so one caller giving up doesn't cancel the result for everyone else waiting on the same key.
+        return await asyncio.shield(future)
+
+    async def load_many(self, keys):
+        return await asyncio.gather(*[self.load(key) for key in keys])
+
+    def stats(self):
+        return {'batches': self.batches,
+                'keys_requested': self.keys_requested,
+                'keys_loaded': self.keys_loaded,
+                'pending': len(self._pending)}
+
+    def _flush(self):
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.ensure_future(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch: dict):
+        self.batches += 1
+        self.keys_loaded += len(batch)
+        try:
+            values = await self.batch_fn(list(batch))
+        except Exception as e:
+            logging.exception(f'Batch load of {len(batch)} keys failed:')
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(values.get(key))
@@ -0,0 +1,53 @@
+'''Measures what it costs to turn a page of books into a response body: the old way (toDict for every book, then the
+whole response encoded with the json module), the cached way (each book's JSON encoded once per version, then joined),
+and the cached way again after every book has changed, so each one has to be re-encoded once.
+
+    python bench_serialization.py --books 10 --rounds 10000
+'''
+import argparse
+import json
+import time
+
+import fast_json
+from book import Book
+
+def make_books(n: int) -> list[Book]:
+    return [Book({'title': f'The Lord of the Rings, part {i}', 'author_name': ['J.R.R. Tolkien'],
+                  'isbn': [f'97802611023{i:02d}'], 'first_publish_year': 1954, 'key': f'/works/OL{i}W',
+                  'format': ['Paperback', 'Hardcover', 'Audio CD'],
+                  'cover_url': f'https://covers.openlibrary.org/b/id/{i}-S.jpg',
+                  'summary': 'A hobbit inherits a ring, and has to take it a very long way to get rid of it. ' * 4},
+                 share=False)
+            for i in range(n)]
+
+def uncached(books, total):
+    return json.dumps({'books': [b.toDict() for b in books], 'total_available': total}).encode()
+
+def cached(books, total):
+    return (b'{"books":' + fast_json.array(b.to_json_bytes() for b in books) +
+            b',"total_available":' + fast_json.dumps(total) + b'}')
+
+def timed(fn, books, rounds: int, change = False) -> float:
+    '''Microseconds per book.'''
+    started = time.perf_counter()
+    for _ in range(rounds):
+        if change:
+            for b in books:
+                b.fully_enriched = not b.fully_enriched
+        fn(books, 1000)
+    return (time.perf_counter() - started) / rounds / len(books) * 1e6
+
+def run(books: int, rounds: int):
+    page = make_books(books)
+    assert json.loads(uncached(page, 1000)) == json.loads(cached(page, 1000))
+    print(f'encoder:              {fast_json.ENCODER}')
+    print(f'toDict + json.dumps:  {timed(uncached, page, rounds):6.2f} us/book')
+    print(f'cached fragments:     {timed(cached, page, rounds):6.2f} us/book')
+    print(f'  every book changed: {timed(cached, page, rounds, change=True):6.2f} us/book')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--books', type=int, default=10, help='books per response')
+    parser.add_argument('--rounds', type=int, default=10000, help='responses to build')
+    args = parser.parse_args()
+    run(args.books, args.rounds)
@@ -0,0 +1,50 @@
+'''Measures how long summaries take from an LLM: the first request against a freshly (un)loaded model, then the
+steady state once the model is loaded and the instruction prefix is cached.  Summaries are generated directly,
+bypassing the summary store and scheduler.
+
+    python bench_summary.py --model llama3.2 --requests 10
+    python bench_summary.py --model llama3.2 --warm     # warm up first, as the app does at startup
+'''
+import argparse
+import asyncio
+import math
+import statistics
+import time
+
+from prompt import book_payload
+from providers import OllamaProvider, get_provider
+from summarize_api import _messages, warm_up
+
+BOOKS = [{'title': 'The Lord of the Rings', 'authors': ['J.R.R. Tolkien'], 'publish_year': 1954,
+          'formats': ['Paperback', 'Hardcover', 'Audio CD']},
+         {'title': 'Sleep Drink Breathe', 'authors': ['Michael Breus'], 'publish_year': 2024},
+         {'title': 'Pride and Prejudice', 'authors': ['Jane Austen'], 'publish_year': 1813, 'formats': ['Paperback']},
+         {'title': 'The Left Hand of Darkness', 'authors': ['Ursula K. Le Guin'], 'publish_year': 1969},
+         {'title': 'Beloved', 'authors': ['Toni Morrison'], 'publish_year': 1987, 'formats': ['Hardcover']}]
+
+async def timed(provider, book) -> float:
+    started = time.monotonic()
+    await provider.complete(_messages(book_payload(book, 8)))
+    return time.monotonic() - started
+
+async def run(model: str, requests: int, warm: bool):
+    provider = get_provider(model)
+    if isinstance(provider, OllamaProvider):
+        await provider.unload() # start from a cold model
+    if warm:
+        started = time.monotonic()
+        await warm_up(model)
+        print(f'warm up:      {time.monotonic() - started:6.2f}s')
+    print(f'first call:   {await timed(provider, BOOKS[0]):6.2f}s')
+    latencies = [await timed(provider, BOOKS[i % len(BOOKS)]) for i in range(1, requests + 1)]
+    latencies.sort()
+    print(f'steady state: {statistics.mean(latencies):6.2f}s mean, {statistics.median(latencies):.2f}s median, '
+          f'{latencies[math.ceil(len(latencies) * 0.95) - 1]:.2f}s p95 over {len(latencies)} calls')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='llama3.2')
+    parser.add_argument('--requests', type=int, default=10, help='calls to make after the first')
+    parser.add_argument('--warm', action='store_true', help='warm the model up before the first call')
+    args = parser.parse_args()
+    asyncio.run(run(args.model, args.requests, args.warm))
@@ -1,28 +1,115 @@
 import asyncio
 import importlib
 import json
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
-from aiohttp import ClientSession
-from summarize_api import summarize_async, summarize_multiple_async
+from book_store import get_book_store
+from config import settings
+import fast_json
+from isbn import canonical_isbn
+from prompt import book_payload
+from broadcast import TokenBroadcast
+from registry import BookRegistry
+from singleflight import SingleFlight
+from summarize_api import summarize_async, summarize_batch_async, summarize_stream
+
+def book_size(book) -> int:
+    '''Roughly how many bytes a book's fields take up.  Private attributes (the cached JSON, its version) are left out:
+       they change without the registry hearing about it, so counting them would leave its total wrong.'''
+    size = sys.getsizeof(book.__dict__)
+    for name, value in book.__dict__.items():
+        if name.startswith('_'):
+            continue
+        size += sys.getsizeof(value)
+        if isinstance(value, list):
+            size += sum(sys.getsizeof(v) for v in value)
+    return size
+
+def book_cost(book) -> float:
+    '''How expensive a book would be to rebuild if it were dropped from the registry.  A bare search result is cheap,
+       a cover costs an upstream call, and a summary costs an LLM generation.'''
+    cost = 1
+    if book.cover_url:
+        cost += settings.cover_rebuild_cost
+    if book.summary:
+        cost += settings.summary_rebuild_cost
+    return cost
+
+# writes to a shared book store, made off the event loop, one at a time so they land in the order they were made.
+_store_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='book-store')
+
+def _write_to_store(write, *args):
+    try:
+        write(*args)
+    except Exception:
+        logging.exception('Unable to write to the book store:')
+
+def isbn_key(isbn):
+    '''What books are indexed under for an ISBN: the canonical ISBN-13, if it's a valid ISBN at all.'''
+    return canonical_isbn(isbn) or isbn
 
 class Book:
-    main = importlib.import_module('main')
     book_api = importlib.import_module("book_api") # name could be pulled from config.  A step towards dependency injection of different ways to find books.
 
-    # a cache for books.  In production, this would be something more sophisticated, like a redis cache, or at least an LRU cache.
-    books_by_isbn = {}
+    # a cache for books, bounded by size and keeping the ones that were most expensive to build.  In production,
+    # this would be something shared between processes, like a redis cache.
+    books_by_isbn = BookRegistry(settings.book_registry_max_bytes, sizeof=book_size, cost=book_cost)
+
+    # book data shared with the other worker processes, behind books_by_isbn.  See book_store.py.
+    store = get_book_store(settings.book_store_url)
+
+    # enrichment currently running, by (isbn, field), so concurrent requests for the same book share the work.
+    in_flight = SingleFlight()
+    # summaries being streamed as they're generated, by isbn, so every listener shares one generation.
+    summary_streams = {}
 
-    def __init__(self, book_dict) :
+    def __init__(self, book_dict, share = True) :
+        self._version = 0 # bumped whenever a field changes, which makes the cached JSON (see to_json_bytes) stale
+        self._json = None
+        self._json_version = None
         self.authors = book_dict['author_name'] if 'author_name' in book_dict else []
         self.title = book_dict['title']
         self.isbn = book_dict['isbn'][0] if 'isbn' in book_dict else None
         self.publish_year = book_dict['first_publish_year'] if 'first_publish_year' in book_dict else None
         self.formats = book_dict['format'] if 'format' in book_dict else None
         self.cover_url = book_dict['cover_url'] if 'cover_url' in book_dict else None
+        if self.cover_url == None and settings.cover_from_search: # saves looking it up later, if the search had it
+            self.cover_url = Book.book_api.cover_url_from_doc(book_dict)
         self.summary = book_dict['summary'] if 'summary' in book_dict else None
+        self._work_key = book_dict['key'] if 'key' in book_dict else None # the OpenLibrary work, e.g. /works/OL27448W
         self.fully_enriched = False
         if self.isbn:
-            Book.books_by_isbn[self.isbn] = self
+            key = isbn_key(self.isbn)
+            Book.books_by_isbn[key] = self
+            for isbn in book_dict['isbn'][1:]: # so the Book is found whichever of its ISBNs is asked for
+                Book.books_by_isbn.alias(isbn_key(isbn), key)
+            if self._work_key: # every edition of the work shares this Book, and so its summary
+                Book.books_by_isbn.alias(self._work_key, key)
+            if share: # not when it came from the store in the first place
+                self._share([isbn_key(isbn) for isbn in book_dict['isbn'][1:]] + ([self._work_key] if self._work_key else []))
+
+    def __setattr__(self, name, value):
+        if not name.startswith('_') and (name not in self.__dict__ or self.__dict__[name] != value):
+            self.__dict__['_version'] = self.__dict__.get('_version', 0) + 1
+        object.__setattr__(self, name, value)
+
+    @property
+    def flight_key(self):
+        '''What work on this book is shared under (see in_flight), the same whichever of its ISBNs it was asked for by.'''
+        return isbn_key(self.isbn) if self.isbn else id(self)
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def to_json_bytes(self) -> bytes:
+        '''toDict, encoded.  It's encoded once per version of the book, so responses can just join the bytes up.'''
+        if self._json_version != self._version:
+            self._json = fast_json.dumps(self.toDict())
+            self._json_version = self._version
+        return self._json
 
     def toJSON(self, fieldsToOmit = []):
         return json.dumps(
@@ -32,85 +119,324 @@ class Book:
         )
     
     def toDict(self, fieldsToOmit = []):
-        return dictExceptFields(self.__dict__, fieldsToOmit)
+        return dictExceptFields({k: v for k, v in self.__dict__.items() if not k.startswith('_')}, fieldsToOmit)
+
+    def to_doc(self):
+        '''This book as a search result, which is how it's shared with other workers.'''
+        doc = {'title': self.title, 'author_name': self.authors, 'isbn': [self.isbn],
+               'first_publish_year': self.publish_year, 'format': self.formats, 'key': self._work_key,
+               'cover_url': self.cover_url, 'summary': self.summary}
+        return {k: v for k, v in doc.items() if v != None}
+
+    def summary_json(self):
+        '''What the LLM is given to summarize: a compact version of the book, without the fields that just produce
+           nonsense from the LLM.'''
+        return book_payload(self.__dict__, settings.prompt_max_list_items)
 
 
     def set_cover_url(self, url: str):
         self.cover_url = url
+        self._updated()
 
     def set_summary(self, summary: str):
-        self.summary = summary  
+        self.summary = summary
+        self._updated()
+
+    def _updated(self):
+        if self.isbn:
+            self.books_by_isbn.refresh(isbn_key(self.isbn))
+            self._share()
+
+    def _share(self, aliases = ()):
+        '''Write this book to the shared store, in the background.'''
+        if Book.store.shared and self.isbn:
+            _store_writer.submit(_write_to_store, Book.store.put, isbn_key(self.isbn), self.to_doc(), aliases)
+
+    async def _try_claim(self, field: str) -> bool:
+        '''Claim fetching field for this book, so no other worker does it too.  Always true unless the store is shared.'''
+        if not Book.store.shared:
+            return True
+        return await asyncio.to_thread(Book.store.claim, f'{self.flight_key}:{field}', settings.book_store_claim_ttl)
+
+    def _release(self, field: str):
+        # through the writer, so it's released only after whatever was fetched has been shared.
+        if Book.store.shared:
+            _store_writer.submit(_write_to_store, Book.store.release, f'{self.flight_key}:{field}')
     
     async def add_summary(self, model:str):
-        summary = await summarize_async(self.toJSON(['cover_url', 'summary', 'isbn']), model)
-        self.summary = summary
+        return await Book.in_flight.do((self.flight_key, 'summary'), self._generate_summary, model)
+
+    async def _generate_summary(self, model:str):
+        stream = Book.summary_streams.get(self.flight_key)
+        if stream: # someone is already streaming this summary, so just wait for them to finish
+            summary = await stream.result()
+        else:
+            summary = await self._claim_or_wait('summary', watch_streams=True)
+        if summary != None:
+            self.set_summary(summary)
+            return summary
+        try:
+            summary = await summarize_async(self.summary_json(), model)
+            self.set_summary(summary) # shared before the claim is released, so anyone waiting on it finds it
+        finally:
+            self._release('summary')
+        return summary
+
+    async def _claim_or_wait(self, field: str, watch_streams = False):
+        '''Make sure only one worker fetches field for this book.  Returns None once this worker has the claim, and so
+           should fetch it (and release the claim), or the value another worker fetched and shared.  With
+           watch_streams, a summary stream started here in the meantime is waited for instead.'''
+        while not await self._try_claim(field):
+            await asyncio.sleep(settings.book_store_poll_interval)
+            stream = Book.summary_streams.get(self.flight_key) if watch_streams else None
+            if stream:
+                return await stream.result()
+            doc = await asyncio.to_thread(Book.store.get, self.flight_key)
+            if doc and doc.get(field):
+                return doc[field]
+        if Book.store.shared: # it may have been shared between the last look and the claim
+            doc = await asyncio.to_thread(Book.store.get, self.flight_key)
+            if doc and doc.get(field):
+                self._release(field)
+                return doc[field]
+        return None
+
+    async def stream_summary(self, model:str):
+        '''Yield the summary as it's generated.  Anyone else asking for this book's summary at the same time gets the
+           same generation, and the finished summary is kept on the book.  If another worker is already generating it,
+           its summary is yielded all at once when it's done.'''
+        key = self.flight_key
+        if self.summary == None and (key, 'summary') in Book.in_flight: # being generated, but not streamed
+            await self.add_summary(model)
+        if self.summary != None:
+            yield self.summary
+            return
+        stream = Book.summary_streams.get(key)
+        if stream is None: # registered before anything is awaited, so everyone here shares it, even while it waits
+            claimed = []
+
+            def finished(summary):
+                Book.summary_streams.pop(key, None)
+                if summary:
+                    self.set_summary(summary)
+                if claimed:
+                    self._release('summary')
+
+            stream = TokenBroadcast(self._summary_tokens(model, claimed), finished)
+            Book.summary_streams[key] = stream
+        async for token in stream.subscribe():
+            yield token
+
+    async def _summary_tokens(self, model: str, claimed: list):
+        '''The summary's tokens as they're generated, or, if another worker is generating it, its whole summary once
+           it's done.  Appends to claimed if this worker took the claim, which is then the caller's to release.'''
+        summary = await self._claim_or_wait('summary')
+        if summary != None:
+            yield summary
+            return
+        claimed.append(True)
+        async for token in summarize_stream(self.summary_json(), model):
+            yield token
 
     async def enrich_fields(self, fields = ['cover_url', 'summary']):
         '''Add the requested fields to self.'''
         fields = await self.gather_fields(fields)
         if fields[0] != None:
-            self.cover_url = fields[0]
+            self.set_cover_url(fields[0])
         if fields[1] != None: #this could overwrite, but that's OK. This value should be as good as the previous one.
-            self.summary = fields[1]
+            self.set_summary(fields[1])
         self.fully_enriched = len(fields) == 2 or (self.summary and self.cover_url)
 
     async def gather_fields(self, fields: list[str]) :
         '''Gather the requested fields simultaneously.'''
         tasks = []
-        async with ClientSession() as session:
-            if 'cover_url' in fields and self.cover_url == None:
-                tasks.append(self.book_api.cover_url_async(self.isbn, session )) #Config.get_client_session()))             
-            else:
-                tasks.append(do_nothing_async())
+        if 'cover_url' in fields and self.cover_url == None:
+            tasks.append(Book.in_flight.do((self.flight_key, 'cover_url'), self.book_api.cover_url_async, self.isbn))
+        else:
+            tasks.append(do_nothing_async())
 
-            if 'summary' in fields and self.summary == None: # the omitted fields just produce nonsense from the LLM
-                tasks.append(self.add_summary(Book.main.settings.model))
-            else:
-                tasks.append(do_nothing_async())
-            result = await asyncio.gather(*tasks)
+        if 'summary' in fields and self.summary == None: # the omitted fields just produce nonsense from the LLM
+            tasks.append(self.add_summary(settings.model))
+        else:
+            tasks.append(do_nothing_async())
+        result = await asyncio.gather(*tasks)
         return result
     
     @classmethod
     def get_by_isbn(cls, isbn):
-        result = cls.books_by_isbn[isbn] if isbn in Book.books_by_isbn else None
+        '''The book with this ISBN (10 or 13, any of the book's editions), if we have it.'''
+        key = isbn_key(isbn)
+        result = cls.books_by_isbn[key] if key in Book.books_by_isbn else None
         return result
 
+    @classmethod
+    async def _from_store(cls, key):
+        '''The book another worker shared under key (one of its ISBNs, or its work), if any.'''
+        if not cls.store.shared:
+            return None
+        doc = await asyncio.to_thread(cls.store.get, key)
+        if doc == None:
+            return None
+        main_key = isbn_key(doc['isbn'][0])
+        book = cls.books_by_isbn[main_key] if main_key in cls.books_by_isbn else cls(doc, share = False)
+        cls.books_by_isbn.alias(key, main_key) # found locally next time
+        return book
+
+    @classmethod
+    async def get_many(cls, isbns) -> list['Book']:
+        '''The books with these ISBNs, in the same order.  Any we haven't seen are looked for in the shared store, and
+           then on OpenLibrary, and kept, so this works for any ISBN, whichever process (if any) did the search that
+           turned it up.  Invalid ISBNs, and ones OpenLibrary doesn't know, are left out.'''
+        books = {isbn: cls.get_by_isbn(isbn) for isbn in isbns}
+        missing = [isbn for isbn, b in books.items() if b is None]
+        if missing and cls.store.shared:
+            for isbn, book in zip(missing, await asyncio.gather(*[cls._from_store(isbn_key(i)) for i in missing])):
+                books[isbn] = book
+            missing = [isbn for isbn, b in books.items() if b is None]
+        if missing:
+            for isbn, doc in zip(missing, await cls.book_api.books_by_isbn_async(missing)):
+                if doc:
+                    books[isbn] = cls.get_by_isbn(isbn) or cls.find(doc) or cls(doc)
+        return [books[isbn] for isbn in isbns if books[isbn]]
+
+    @classmethod
+    def get_by_work(cls, work_key):
+        return cls.books_by_isbn[work_key] if work_key and work_key in cls.books_by_isbn else None
+
+    @classmethod
+    def find(cls, book_dict):
+        '''The book we already have for a search result, whether by its work or by any of its ISBNs.'''
+        book = cls.get_by_work(book_dict.get('key'))
+        for isbn in book_dict.get('isbn', []):
+            if book:
+                break
+            book = cls.get_by_isbn(isbn)
+        return book
+
+    @classmethod
+    async def find_shared(cls, book_dict):
+        '''find, or else the book another worker shared for the search result.  Only its work and first ISBN are looked
+           for in the store, since a shared book is shared under all of them.'''
+        book = cls.find(book_dict)
+        if book or not cls.store.shared:
+            return book
+        if book_dict.get('key'):
+            book = await cls._from_store(book_dict['key'])
+        if not book and book_dict.get('isbn'):
+            book = await cls._from_store(isbn_key(book_dict['isbn'][0]))
+        return book
+
 
 ## These functions operate on lists of books, not individual books.
 
+async def books_for_docs(docs) -> list[Book]:
+    '''Books for a page of search results, reusing the ones already seen (here or, with a shared store, by another
+       worker), since they might already be enriched.  A book is the same one already seen if it's the same work, or
+       shares any ISBN with it.'''
+    shared = await asyncio.gather(*[Book.find_shared(b) for b in docs]) if Book.store.shared else [None] * len(docs)
+    books = []
+    for b, book in zip(docs, shared):
+        books.append(book or Book.find(b) or Book(b)) # find again, in case an earlier result was the same book
+    return books
+
 async def add_covers_to_books(books: list[Book]):
     filtered_books = [b for b in books if b.cover_url == None]
     isbns = [ b.isbn for b in filtered_books]
     urls = await Book.book_api.cover_urls_async(isbns)
     for i, url in enumerate(urls):
         if filtered_books[i].cover_url == None: # just in case something else retrieved it while this was running
-            filtered_books[i].cover_url = url
-
-async def enrich_fields_books_async(books, fields):
-    '''Enrich all elements of books with the relevant fields.  Note that the will all run simultaneously,
-       so if they're not I/O bound, you might have to wait a long time to get any answers.  For non-I/O bound
-       tasks like generating summaries, it's better to send them one at a time, so they can return as soon
-       as each individual task is completed.'''
-    async with asyncio.TaskGroup () as tg:
-        for book in books:
-            tg.create_task(book.enrich_fields(fields))
-    return books
+            filtered_books[i].set_cover_url(url)
+
+class EnrichmentStats:
+    '''For each field asked for by /book: how often the book already had it (hits), someone else was already
+       fetching it (joined), or it had to be fetched (fetched).'''
+
+    def __init__(self):
+        self.requests = 0
+        self.counts = {}
+
+    def record(self, counts: dict):
+        self.requests += 1
+        for field, field_counts in counts.items():
+            totals = self.counts.setdefault(field, {'hits': 0, 'joined': 0, 'fetched': 0})
+            for k, v in field_counts.items():
+                totals[k] += v
+
+    def stats(self):
+        return {'requests': self.requests, **self.counts}
+
+enrichment_stats = EnrichmentStats()
+
+async def enrich_books(books: list[Book], fields: list[str]) -> dict:
+    '''Add the requested fields to books, looking at each book once: every missing cover goes to OpenLibrary in one
+       batched request, missing summaries are generated settings.summary_batch_size to an LLM request, and anything
+       already being fetched for someone else is waited on rather than fetched again.  Returns the hits, joined and fetched counts per field.'''
+    counts = {field: {'hits': 0, 'joined': 0, 'fetched': 0} for field in fields if field in ('cover_url', 'summary')}
+    new_covers, new_summaries, jobs = [], [], []
+    for book in dict.fromkeys(books): # the same Book can be asked for under several ISBNs
+        if 'cover_url' in counts:
+            if book.cover_url != None:
+                counts['cover_url']['hits'] += 1
+            elif (book.flight_key, 'cover_url') in Book.in_flight:
+                counts['cover_url']['joined'] += 1
+                jobs.append(book.enrich_fields(['cover_url']))
+            else:
+                counts['cover_url']['fetched'] += 1
+                new_covers.append(book)
+        if 'summary' in counts:
+            key = book.flight_key
+            if book.summary != None:
+                counts['summary']['hits'] += 1
+            else:
+                joined = (key, 'summary') in Book.in_flight or key in Book.summary_streams
+                counts['summary']['joined' if joined else 'fetched'] += 1
+                if joined:
+                    jobs.append(book.add_summary(settings.model))
+                else:
+                    new_summaries.append(book)
+    if new_covers:
+        jobs.append(add_covers_to_books(new_covers))
+    if new_summaries and Book.store.shared: # other workers may be summarizing some of these, so wait for theirs
+        claimed = await asyncio.gather(*[b._try_claim('summary') for b in new_summaries])
+        jobs += [b.add_summary(settings.model) for b, mine in zip(new_summaries, claimed) if not mine]
+        new_summaries = [b for b, mine in zip(new_summaries, claimed) if mine]
+    batch_size = max(1, settings.summary_batch_size)
+    for i in range(0, len(new_summaries), batch_size):
+        jobs.append(summarize_books(new_summaries[i:i + batch_size], settings.model))
+    async with asyncio.TaskGroup() as tg:
+        for job in jobs:
+            tg.create_task(job)
+    for book in books:
+        book.fully_enriched = bool(book.cover_url and book.summary)
+    enrichment_stats.record(counts)
+    return counts
+
+async def summarize_books(books: list[Book], model: str):
+    '''Summarize several books with one LLM request (see summarize_batch_async).  Each book's summary is shared through
+       Book.in_flight, just as add_summary's would be, so anyone else asking for one of them waits for this batch.
+       The books' summary claims (see Book._try_claim) are taken by the caller, and released here.'''
+    batch = asyncio.ensure_future(summarize_batch_async([b.summary_json() for b in books], model))
+
+    async def summary_from_batch(book: Book, i: int):
+        summary = (await batch)[i]
+        if summary and book.summary == None:
+            book.set_summary(summary)
+        return summary
 
+    async def summary_for(book: Book, i: int):
+        try:
+            return await Book.in_flight.do((book.flight_key, 'summary'), summary_from_batch, book, i)
+        finally:
+            book._release('summary')
 
-async def add_summaries_to_books(books: list[Book]):
-    filtered_books = [b for b in books if b.summary == None]    
-    jsons = [b.toJSON() for b in filtered_books]
-    summaries = await summarize_multiple_async(jsons)
-    for i, summary in enumerate(summaries):
-        if filtered_books[i].summary == None: # just in case something else retrieved it while this was running
-            filtered_books[i].summary = summary
+    return await asyncio.gather(*[summary_for(b, i) for i, b in enumerate(books)])
 
 
 
 ## Utilities
 def dictExceptFields(dict, fieldsToOmit: list[str], dropEmptyFields = True): 
-    dict = {k:v for k, v in dict.items() if v} # remove empty fields
-    return {k: dict[k] for k in set(list(dict.keys())) - set(fieldsToOmit)}
+    # in the original order, so the same book always encodes to the same bytes (and ETag), whatever the hash seed.
+    return {k: v for k, v in dict.items() if v and k not in fieldsToOmit}
 
 async def do_nothing_async():
     return
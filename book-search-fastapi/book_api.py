@@ -1,46 +1,183 @@
 import logging
-import requests
+import re
 import asyncio
-from aiohttp import ClientSession
-
-def search(title, limit: int, page = 1 ): 
-    fields = ['author_name', 'format', 'isbn', 'first_publish_year','title', 'first_sentence']
-    headers = {'Content-Type': 'application/json'}
-    params = 'q={}&page={}&limit={}&fields={}'.format(title, page, limit, ','.join(fields))
-    r = requests.get('https://openlibrary.org/search.json', params, headers=headers) 
-    res = r.json()
-    books = res['docs']
-    return books, res['numFound'] 
-
-def cover_url(isbn):
-    """Given an ISBN number, fetch the URL of the cover of that book."""
-    try :  
-        r = requests.get('https://openlibrary.org/api/books', f'bibkeys=ISBN:{isbn}&format=json')
-        json = r.json()[f'ISBN:{isbn}']
-        url = json['thumbnail_url'] if 'thumbnail_url' in json else None
-        return url
-    except: 
-        logging.exception(f'Unable to retrieve cover for {isbn}.')
-        return None
-
-async def cover_url_async(isbn, session: ClientSession):
-    """Given an ISBN number, fetch the URL of the cover of that book."""
-    try: 
-        resp = await(session.request(method='GET', url=f'https://openlibrary.org/api/books?bibkeys=ISBN:{isbn}&format=json'))
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from cachetools import TTLCache
+
+from batcher import BatchLoader
+from config import settings
+from isbn import canonical_isbn
+from prefetch import PrefetchScheduler
+from search_cache import SearchCache, search_key
+from singleflight import SingleFlight
+
+# A single pooled client shared by every request, so calls to openlibrary.org reuse warm connections
+# instead of paying DNS + TCP + TLS each time.  It's opened and closed by the app's lifespan (see main.py),
+# but will be created lazily if something calls in before that (e.g. from a shell).
+_session: ClientSession = None
+
+async def open_session() -> ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        connector = TCPConnector(limit=settings.http_max_connections,
+                                 limit_per_host=settings.http_max_connections_per_host,
+                                 keepalive_timeout=settings.http_keepalive_timeout,
+                                 ttl_dns_cache=settings.http_dns_cache_ttl)
+        timeout = ClientTimeout(total=settings.http_timeout, sock_connect=settings.http_connect_timeout)
+        _session = ClientSession(connector=connector, timeout=timeout)
+    return _session
+
+async def close_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+# results of searches, so repeated (or only trivially different) queries never go back to OpenLibrary.
+search_cache = SearchCache(settings.search_cache_max_bytes, settings.search_cache_ttl)
+# searches on their way to OpenLibrary, so identical ones arriving at the same time only go once.
+searches_in_flight = SingleFlight()
+
+SEARCH_FIELDS = ['author_name', 'format', 'isbn', 'first_publish_year','title', 'first_sentence', 'key']
+if settings.cover_from_search:
+    SEARCH_FIELDS += ['cover_i', 'cover_edition_key']
+
+async def search_async(title, limit: int, page = 1, session: ClientSession = None):
+    """Search OpenLibrary for books by title.  Concurrent calls for the same (normalized) search share a single
+       upstream request."""
+    cached = search_cache.lookup(title, page, limit)
+    if cached:
+        return cached
+    return await searches_in_flight.do(search_key(title, page, limit), _fetch_search, title, limit, page, session)
+
+async def _fetch_search(title, limit: int, page, session: ClientSession):
+    session = session or await open_session()
+    params = {'q': title, 'page': page, 'limit': limit, 'fields': ','.join(SEARCH_FIELDS)}
+    async with session.get(f'{settings.open_library_url}/search.json', params=params) as resp:
         resp.raise_for_status()
-        data = await(resp.json())
-        data = data[f'ISBN:{isbn}']
-        return data['thumbnail_url'] if 'thumbnail_url' in data else None
-    except:
-        logging.exception(f"Exception looking for cover for {isbn}:")
-        return None
+        res = await resp.json()
+    search_cache.store(title, page, limit, (res['docs'], res['numFound']))
+    return res['docs'], res['numFound']
+
+def cover_url_from_doc(doc):
+    """The URL of a search result's cover, worked out from the cover id or edition it came with, without asking
+       OpenLibrary.  None if it came with neither."""
+    if doc.get('cover_i'):
+        return f"{settings.covers_url}/b/id/{doc['cover_i']}-{settings.cover_size}.jpg"
+    if doc.get('cover_edition_key'):
+        return f"{settings.covers_url}/b/olid/{doc['cover_edition_key']}-{settings.cover_size}.jpg"
+    return None
+
+async def cover_url_async(isbn):
+    """Given an ISBN number, fetch the URL of the cover of that book.  Lookups from every request in the process that
+       arrive within a few ms of each other are combined into one call to OpenLibrary (see cover_loader)."""
+    return await cover_loader.load(isbn)
 
 async def cover_urls_async(isbns): 
-    async with ClientSession() as session:
-        tasks = []
+    """Fetch the cover URLs for a list of ISBNs, in the same order, sharing upstream calls with other requests."""
+    return await cover_loader.load_many(isbns)
+
+async def fetch_cover_urls(isbns, session: ClientSession = None, chunk_size: int = None, max_concurrent_chunks: int = None): 
+    """Fetch the cover URLs for a list of ISBNs, in the same order.  The books API accepts many bibkeys per call, so the
+       ISBNs are sent in chunks of chunk_size, with at most max_concurrent_chunks requests outstanding at once."""
+    return await _fetch_chunked(_fetch_cover_urls, isbns, session, chunk_size, max_concurrent_chunks)
+
+async def _fetch_chunked(fetch, isbns, session: ClientSession = None, chunk_size: int = None, max_concurrent_chunks: int = None):
+    """Call fetch(chunk, session) -> dict of isbn -> value for chunks of isbns, a few at once, and return the values
+       in the same order as isbns."""
+    session = session or await open_session()
+    chunk_size = chunk_size or settings.cover_batch_size
+    limit = asyncio.Semaphore(max_concurrent_chunks or settings.cover_batch_concurrency)
+    unique_isbns = list(dict.fromkeys(isbn for isbn in isbns if isbn))
+    chunks = [unique_isbns[i:i + chunk_size] for i in range(0, len(unique_isbns), chunk_size)]
+
+    async def fetch_chunk(chunk):
+        async with limit:
+            return await fetch(chunk, session)
+
+    values_by_isbn = {}
+    for values in await asyncio.gather(*[fetch_chunk(chunk) for chunk in chunks]):
+        values_by_isbn.update(values)
+    return [values_by_isbn.get(isbn) for isbn in isbns]
+
+async def _fetch_cover_urls(isbns, session: ClientSession) -> dict:
+    """One call to the books API for all of isbns.  Returns a dict of isbn -> url (or None)."""
+    try: 
+        bibkeys = ','.join(f'ISBN:{isbn}' for isbn in isbns)
+        async with session.get(f'{settings.open_library_url}/api/books', params={'bibkeys': bibkeys, 'format': 'json'}) as resp:
+            resp.raise_for_status()
+            data = await(resp.json())
+        return {isbn: data.get(f'ISBN:{isbn}', {}).get('thumbnail_url') for isbn in isbns}
+    except:
+        logging.exception(f"Exception looking for covers for {isbns}:")
+        return {}
+
+async def books_by_isbn_async(isbns):
+    """Look books up by ISBN directly, for ISBNs that no search in this process has turned up.  Returns, in the same
+       order, each book as a dict shaped like a search result (see doc_from_edition), or None for ISBNs OpenLibrary
+       doesn't know.  Like cover lookups, these are combined with other requests' into as few calls as possible.
+       Only valid ISBNs are sent, as ISBN-13s, and ones OpenLibrary recently didn't know aren't sent again."""
+    isbn13s = [canonical_isbn(isbn) for isbn in isbns]
+    wanted = [str(isbn13) for isbn13 in dict.fromkeys(isbn13s) if isbn13 and isbn13 not in missing_isbns]
+    docs = dict(zip(wanted, await book_loader.load_many(wanted)))
+    return [docs.get(str(isbn13)) for isbn13 in isbn13s]
+
+def doc_from_edition(isbn, edition: dict) -> dict:
+    """A search result for the book, from what the books API's jscmd=data returns for one of its editions.  The ISBN
+       asked for comes first, so the Book is registered under it.  The year is the edition's, which may be later than
+       the work's first publication."""
+    identifiers = edition.get('identifiers', {})
+    doc = {'title': edition.get('title', ''),
+           'author_name': [a['name'] for a in edition.get('authors', []) if 'name' in a],
+           'isbn': list(dict.fromkeys([isbn] + identifiers.get('isbn_13', []) + identifiers.get('isbn_10', [])))}
+    year = re.search(r'\d{4}', edition.get('publish_date', ''))
+    if year:
+        doc['first_publish_year'] = int(year.group())
+    if edition.get('works'):
+        doc['key'] = edition['works'][0]['key']
+    cover = edition.get('cover', {}).get({'S': 'small', 'M': 'medium', 'L': 'large'}.get(settings.cover_size, 'small'))
+    if cover:
+        doc['cover_url'] = cover
+    return doc
+
+async def _fetch_books(isbns, session: ClientSession) -> dict:
+    """One call to the books API for all of isbns, with full edition data.  Returns a dict of isbn -> doc."""
+    try:
+        bibkeys = ','.join(f'ISBN:{isbn}' for isbn in isbns)
+        async with session.get(f'{settings.open_library_url}/api/books', params={'bibkeys': bibkeys, 'format': 'json', 'jscmd': 'data'}) as resp:
+            resp.raise_for_status()
+            data = await(resp.json())
         for isbn in isbns:
-            tasks.append(
-                cover_url_async(isbn, session)
-            )
-        result = await asyncio.gather(*tasks) 
-    return result
+            if f'ISBN:{isbn}' not in data:
+                missing_isbns[canonical_isbn(isbn)] = True
+        return {isbn: doc_from_edition(isbn, data[f'ISBN:{isbn}']) for isbn in isbns if f'ISBN:{isbn}' in data}
+    except: # not remembered as missing, since it may be there next time
+        logging.exception(f"Exception looking up books {isbns}:")
+        return {}
+
+async def _prefetch_search(title, page, limit):
+    await search_async(title, limit, page)
+
+# searches run in the background, so their results are waiting in search_cache when they're wanted.
+prefetcher = PrefetchScheduler(_prefetch_search, search_cache,
+                               max_pending=settings.prefetch_max_pending,
+                               workers=settings.prefetch_workers,
+                               max_age=settings.prefetch_max_age)
+
+async def _load_cover_urls(isbns) -> dict:
+    return dict(zip(isbns, await fetch_cover_urls(isbns)))
+
+cover_loader = BatchLoader(_load_cover_urls,
+                            window=settings.cover_batch_window_ms / 1000,
+                            max_batch_size=settings.cover_batch_size * settings.cover_batch_concurrency)
+
+async def _load_books(isbns) -> dict:
+    return dict(zip(isbns, await _fetch_chunked(_fetch_books, isbns)))
+
+# ISBN-13s (as ints) the books API had nothing for, so asking again for a made-up ISBN doesn't go upstream every time.
+missing_isbns = TTLCache(maxsize=settings.missing_isbn_max, ttl=settings.missing_isbn_ttl)
+
+# the same batching for looking books up by ISBN, sized like the cover lookups since it's the same API.
+book_loader = BatchLoader(_load_books,
+                          window=settings.cover_batch_window_ms / 1000,
+                          max_batch_size=settings.cover_batch_size * settings.cover_batch_concurrency)
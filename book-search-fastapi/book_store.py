@@ -0,0 +1,223 @@
+import json
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+class BookStore:
+    '''Book data shared by every worker process, behind each process's own registry of Books, so a cover or summary
+       found by one worker is there for all of them.  Books are kept as search-result-shaped dicts (see Book.to_doc)
+       under their main key, with aliases (their other ISBNs, their work) that find the same dict.
+
+       Claims let workers agree on which of them does a piece of work: claim(name, ttl) is true for exactly one caller
+       until that caller releases it or ttl seconds pass.
+
+       This base class is the in-process store: it shares nothing, so each worker keeps to its own registry, and every
+       claim succeeds.  See get_book_store for the others.
+
+       The methods block (on a file or a socket), so from async code, call them in a thread.  Book does, and skips the
+       store altogether when it isn't shared.'''
+
+    shared = False
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.claims_lost = 0
+
+    def get(self, key) -> dict:
+        return None
+
+    def put(self, key, doc: dict, aliases=()):
+        pass
+
+    def claim(self, name: str, ttl: float) -> bool:
+        return True
+
+    def release(self, name: str):
+        pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'backend': type(self).__name__,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'writes': self.writes,
+                'claims_lost': self.claims_lost}
+
+    def _counted(self, doc):
+        if doc is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return doc
+
+class SQLiteBookStore(BookStore):
+    '''Shared by the workers on one host, through a SQLite file in WAL mode (so readers never wait on the writer).'''
+
+    shared = True
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._local = threading.local() # sqlite connections can't be shared across threads, so each gets its own.
+
+    def get(self, key) -> dict:
+        row = self._connection().execute('''SELECT doc FROM books
+                                            WHERE key = COALESCE((SELECT key FROM aliases WHERE alias = ?), ?)''',
+                                         (str(key), str(key))).fetchone()
+        return self._counted(json.loads(row[0]) if row else None)
+
+    def put(self, key, doc: dict, aliases=()):
+        with self._connection() as db:
+            db.execute('INSERT OR REPLACE INTO books (key, doc, updated) VALUES (?, ?, ?)',
+                       (str(key), json.dumps(doc), time.time()))
+            db.executemany('INSERT OR REPLACE INTO aliases (alias, key) VALUES (?, ?)',
+                           [(str(alias), str(key)) for alias in aliases if alias != key])
+        self.writes += 1
+
+    def claim(self, name: str, ttl: float) -> bool:
+        now = time.time()
+        with self._connection() as db:
+            db.execute('DELETE FROM claims WHERE name = ? AND expires < ?', (name, now))
+            claimed = db.execute('INSERT OR IGNORE INTO claims (name, expires) VALUES (?, ?)', (name, now + ttl)).rowcount == 1
+        if not claimed:
+            self.claims_lost += 1
+        return claimed
+
+    def release(self, name: str):
+        with self._connection() as db:
+            db.execute('DELETE FROM claims WHERE name = ?', (name,))
+
+    def _connection(self) -> sqlite3.Connection:
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('CREATE TABLE IF NOT EXISTS books (key TEXT PRIMARY KEY, doc TEXT NOT NULL, updated REAL NOT NULL)')
+            db.execute('CREATE TABLE IF NOT EXISTS aliases (alias TEXT PRIMARY KEY, key TEXT NOT NULL)')
+            db.execute('CREATE TABLE IF NOT EXISTS claims (name TEXT PRIMARY KEY, expires REAL NOT NULL)')
+            self._local.db = db
+        return db
+
+class RedisBookStore(BookStore):
+    '''Shared by every worker that can reach a Redis server (or anything else speaking its protocol).  Only GET, SET
+       and DEL are used, over a small client of our own rather than another dependency.  Books are kept under
+       prefix + 'book:' + key, aliases under prefix + 'alias:' + alias and claims under prefix + 'claim:' + name.'''
+
+    shared = True
+
+    def __init__(self, host: str, port: int, db: int = 0, password: str = None, prefix: str = 'book-search:', timeout: float = 2):
+        super().__init__()
+        self.prefix = prefix
+        self._client = RespClient(host, port, db, password, timeout)
+
+    def get(self, key) -> dict:
+        key = self._client.call('GET', f'{self.prefix}alias:{key}') or str(key).encode()
+        doc = self._client.call('GET', f'{self.prefix}book:{key.decode()}')
+        return self._counted(json.loads(doc) if doc else None)
+
+    def put(self, key, doc: dict, aliases=()):
+        self._client.call('SET', f'{self.prefix}book:{key}', json.dumps(doc))
+        for alias in aliases:
+            if alias != key:
+                self._client.call('SET', f'{self.prefix}alias:{alias}', str(key))
+        self.writes += 1
+
+    def claim(self, name: str, ttl: float) -> bool:
+        claimed = self._client.call('SET', f'{self.prefix}claim:{name}', '1', 'NX', 'PX', str(int(ttl * 1000))) is not None
+        if not claimed:
+            self.claims_lost += 1
+        return claimed
+
+    def release(self, name: str):
+        self._client.call('DEL', f'{self.prefix}claim:{name}')
+
+class RespClient:
+    '''A minimal blocking client for the Redis protocol (RESP): one connection, one command at a time, reconnecting
+       if the connection drops.  Replies come back as bytes, int, None or lists of those; error replies raise.'''
+
+    def __init__(self, host: str, port: int, db: int = 0, password: str = None, timeout: float = 2):
+        self.address = (host, port)
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._socket = None
+        self._reader = None
+
+    def call(self, *args):
+        with self._lock:
+            try:
+                return self._call(args)
+            except OSError: # the connection dropped, e.g. the server restarted.  Try once more on a new one.
+                self._close()
+                return self._call(args)
+
+    def _call(self, args):
+        if self._socket is None:
+            self._connect()
+        self._socket.sendall(self._encode(args))
+        return self._read_reply()
+
+    def _connect(self):
+        self._socket = socket.create_connection(self.address, timeout=self.timeout)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._socket.makefile('rb')
+        if self.password:
+            self._call(('AUTH', self.password))
+        if self.db:
+            self._call(('SELECT', str(self.db)))
+
+    def _close(self):
+        if self._socket is not None:
+            self._reader.close()
+            self._socket.close()
+        self._socket = self._reader = None
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            arg = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError('Connection closed by the server')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest
+        if kind == b'-':
+            raise RuntimeError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(rest)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise ConnectionError(f'Unexpected reply from the server: {line!r}')
+
+def get_book_store(url: str) -> BookStore:
+    '''The store for a URL: "memory" (or empty) for the in-process store, "sqlite:///path/to/file" for a SQLite file
+       shared by the workers on this host, or "redis://[:password@]host[:port][/db]" for a Redis server.'''
+    if not url or url == 'memory':
+        return BookStore()
+    parsed = urlparse(url)
+    if parsed.scheme == 'sqlite':
+        return SQLiteBookStore(url[len('sqlite:///'):])
+    if parsed.scheme == 'redis':
+        return RedisBookStore(parsed.hostname or 'localhost', parsed.port or 6379,
+                              int(parsed.path.lstrip('/') or 0), parsed.password)
+    raise ValueError(f'Unknown book store {url}')
@@ -0,0 +1,54 @@
+import asyncio
+import logging
+
+class TokenBroadcast:
+    '''Fans a single stream of tokens (e.g. an LLM generation) out to any number of subscribers.  Each subscriber
+       gets everything generated so far, then each new token as it arrives, so it doesn't matter when they join.
+       on_complete(text) is called once the source finishes, with the full text, or None if it failed.'''
+
+    def __init__(self, source, on_complete=None):
+        self.tokens = []
+        self.done = False
+        self.error = None
+        self.on_complete = on_complete
+        self._changed = asyncio.Condition()
+        self._task = asyncio.create_task(self._run(source))
+
+    @property
+    def text(self) -> str:
+        return ''.join(self.tokens)
+
+    async def subscribe(self):
+        '''Yield every token of the generation, from the beginning.'''
+        seen = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: seen < len(self.tokens) or self.done)
+                new_tokens = self.tokens[seen:]
+                done = self.done
+            seen += len(new_tokens)
+            for token in new_tokens:
+                yield token
+            if done:
+                break
+
+    async def result(self) -> str:
+        '''Wait for the generation to finish and return its full text (or None if it failed).'''
+        await asyncio.shield(self._task)
+        return None if self.error else self.text
+
+    async def _run(self, source):
+        try:
+            async for token in source:
+                if token:
+                    async with self._changed:
+                        self.tokens.append(token)
+                        self._changed.notify_all()
+        except Exception as e:
+            self.error = e
+            logging.exception('Token stream failed:')
+        async with self._changed:
+            self.done = True
+            self._changed.notify_all()
+        if self.on_complete:
+            self.on_complete(None if self.error else self.text)
@@ -0,0 +1,80 @@
+from pydantic_settings import BaseSettings
+
+class Settings(BaseSettings):
+    books_per_page: int = 10
+    model: str = 'gpt-4o-mini'
+#    model: str = 'llama3.2'
+
+    open_library_url: str = 'https://openlibrary.org'
+
+    # the LLM used for summaries.  See providers.py.  Models named 'local...' use a stand-in that needs no LLM.
+    ollama_host: str | None = None       # defaults to OLLAMA_HOST, or the local ollama server
+    llm_timeout: float = 120             # seconds
+    ollama_keep_alive: str = '30m'       # how long ollama keeps the model loaded after a request
+    llm_warm_up: bool = True             # load the model as the app starts, rather than on the first summary
+    local_seconds_per_token: float = 0   # how slow the 'local' stand-in pretends to be
+    summary_concurrency: int = 2         # generations the LLM backend is given at once, to start with.  See scheduler.py.
+    # ... which is then tuned to the backend's throughput, within these bounds.  See tuner.py.
+    summary_autotune: bool = True
+    summary_concurrency_max: int = 8
+    summary_target_p95: float = 20       # seconds per generation
+    summary_batch_size: int = 4          # books per request when summarizing several at once
+    prompt_max_list_items: int = 8       # longer lists (formats, authors) are cut short in prompts.  See prompt.py.
+
+    # search results, keyed by normalized query.  See search_cache.py.
+    search_cache_max_bytes: int = 32 * 1024 * 1024
+    search_cache_ttl: float = 60 * 60    # seconds
+
+    # next pages of search results are fetched in the background.  See prefetch.py.
+    prefetch_workers: int = 2
+    prefetch_max_pending: int = 100
+    prefetch_max_age: float = 10         # seconds a prefetch can wait before it's considered stale
+
+    # /search/stream.  See streaming.py.
+    stream_max_queued_events: int = 32   # events waiting on a slow client before enrichment pauses
+    stream_summary_concurrency: int = 2  # summaries generated at once for a single stream
+
+    # the in-process Book registry is bounded by (approximate) size, evicting the books cheapest to rebuild first.
+    book_registry_max_bytes: int = 64 * 1024 * 1024
+    cover_rebuild_cost: float = 5        # relative to a bare search result, which costs 1
+    summary_rebuild_cost: float = 500
+
+    # where generated summaries are kept between runs.  See summary_store.py.
+    summary_store_path: str = 'summaries.sqlite3'
+
+    # where book data is shared between worker processes: "memory" (not shared), "sqlite:///books.sqlite3" or
+    # "redis://localhost:6379/0".  See book_store.py.
+    book_store_url: str = 'memory'
+    book_store_claim_ttl: float = 120      # seconds another worker waits for a summary before generating it itself
+    book_store_poll_interval: float = 0.5  # seconds between checks for a summary another worker is generating
+
+    # the pooled HTTP client used for every call to OpenLibrary.  See book_api.open_session.
+    http_max_connections: int = 100
+    http_max_connections_per_host: int = 20
+    http_keepalive_timeout: float = 30   # seconds an idle connection is kept around for reuse
+    http_dns_cache_ttl: int = 300        # seconds
+    http_connect_timeout: float = 5
+    http_timeout: float = 15             # total seconds allowed for a single upstream request
+
+    # derive cover URLs from the cover ids search results carry, and only look up the covers of books without one.
+    cover_from_search: bool = False
+    covers_url: str = 'https://covers.openlibrary.org'
+    cover_size: str = 'S'                # S, M or L.  S is what the books API's thumbnail_url gives.
+
+    # how long browsers and caches may reuse /search and /book responses, in seconds: briefly while any book is still
+    # missing a cover or summary, since it'll change once they arrive, and much longer once they're all there.
+    cache_max_age_partial: int = 5
+    cache_max_age_enriched: int = 86400
+    # responses smaller than this aren't worth compressing.
+    compression_min_size: int = 500
+
+    # cover lookups send many ISBNs per call to OpenLibrary's books API.  See book_api.cover_urls_async.
+    cover_batch_size: int = 20
+    cover_batch_concurrency: int = 4
+    # how long to hold a cover lookup so it can share a books API call with lookups from other requests.
+    cover_batch_window_ms: float = 5
+    # ISBNs OpenLibrary didn't know aren't asked about again for this many seconds.
+    missing_isbn_ttl: float = 600
+    missing_isbn_max: int = 100_000
+
+settings = Settings()
@@ -0,0 +1,17 @@
+import os
+import tempfile
+
+import pytest
+
+# settings are read as config is first imported, so these have to be in place before any test imports the app:
+# a stand-in LLM, stores in a scratch directory, and nothing sent to the real OpenLibrary.  (Not :memory: for the
+# summary store, since each thread would get a database of its own.)
+os.environ.setdefault('MODEL', 'local')
+os.environ.setdefault('LLM_WARM_UP', 'false')
+os.environ.setdefault('SUMMARY_STORE_PATH', os.path.join(tempfile.mkdtemp(), 'summaries.sqlite3'))
+os.environ.setdefault('BOOK_STORE_URL', 'memory')
+os.environ.setdefault('OPEN_LIBRARY_URL', 'http://127.0.0.1:9')
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
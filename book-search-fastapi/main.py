@@ -1,21 +1,43 @@
-import concurrent
-from typing import Annotated
-from fastapi import FastAPI, Query
-from fastapi.responses import RedirectResponse
+import asyncio
+import hashlib
+import logging
+from contextlib import asynccontextmanager
+from typing import Annotated, Literal
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from book import Book, add_covers_to_books, enrich_fields_books_async
-from pydantic_settings import BaseSettings
+from fastapi.middleware.gzip import GZipMiddleware
+from book import Book, books_for_docs, enrich_books, enrichment_stats
+from config import settings
 
 import book_api
+import fast_json
+import scheduler
+import streaming
+import summarize_api
 
-class Settings(BaseSettings):
-    books_per_page: int = 10
-    model: str = 'gpt-4o-mini'
-#    model: str = 'llama3.2'
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # one pooled, keep-alive HTTP client for the life of the app, rather than one per call.
+    await book_api.open_session()
+    book_api.prefetcher.start()
+    warm_up = None
+    if settings.llm_warm_up: # in the background, so the app doesn't wait on the model to start serving searches
+        warm_up = asyncio.create_task(summarize_api.warm_up(settings.model))
+    yield
+    if warm_up:
+        warm_up.cancel() # if it's still going, there's no longer any point
+        try:
+            await warm_up
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logging.exception('Warming up the model failed:')
+    await book_api.prefetcher.stop()
+    await book_api.close_session()
 
-settings = Settings()
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # useful when the UI is being run by vite on 5173, which is not yet committed.
 origins = ['http://localhost:5173',
@@ -29,29 +51,86 @@ app.add_middleware(
     allow_headers=['*']
 )
 
+# brotli compresses JSON noticeably better than gzip, but needs brotli-asgi.  Without it, gzip.
+try:
+    from brotli_asgi import BrotliMiddleware
+    app.add_middleware(BrotliMiddleware, minimum_size=settings.compression_min_size, gzip_fallback=True)
+except ImportError:
+    app.add_middleware(GZipMiddleware, minimum_size=settings.compression_min_size)
+
+@app.middleware('http')
+async def identify_user(request: Request, call_next):
+    # summary work is shared out fairly between users (see scheduler.py).  Without logins, a user is whatever the
+    # client says it is, or else its address.
+    scheduler.summary_user.set(request.headers.get('x-user-id') or (request.client.host if request.client else None))
+    return await call_next(request)
+
+def json_response(request: Request, content: bytes, books: list[Book], headers = None, longest: int = None) -> Response:
+    '''A response for books, whose JSON is already encoded (see Book.to_json_bytes), so it's sent as is rather than
+       re-encoded.  It's tagged with a hash of the content, and if the client already has that, it's told so (304)
+       instead of being sent it all again.  The tag is weak, since the bytes sent depend on the compression.
+       Once the books are fully enriched it can be cached for cache_max_age_enriched seconds, or longest if that's
+       shorter.'''
+    fully_enriched = books and all(b.fully_enriched for b in books)
+    max_age = settings.cache_max_age_enriched if fully_enriched else settings.cache_max_age_partial
+    if longest is not None:
+        max_age = min(max_age, longest)
+    headers = {**(headers or {}),
+               'ETag': f'W/"{hashlib.blake2b(content, digest_size=16).hexdigest()}"',
+               'Cache-Control': f'public, max-age={max_age}'}
+    if etag_matches(request.headers.get('if-none-match'), headers['ETag']):
+        # the compression middleware adds Vary: Accept-Encoding to what it compresses, but leaves this alone.
+        return Response(status_code=304, headers={**headers, 'Vary': 'Accept-Encoding'})
+    return Response(content, media_type='application/json', headers=headers)
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match compares weakly: W/"x" matches "x".
+    if not if_none_match:
+        return False
+    tags = [t.strip().removeprefix('W/') for t in if_none_match.split(',')]
+    return '*' in tags or etag.removeprefix('W/') in tags
 
 @app.get("/search")
-def search(title: str =Query ('', description="Search query, which is assumed to be part of the title."), 
-           page: int = Query(1, description='Which page of search results should be returned.')):
+async def search(request: Request,
+                 title: str =Query ('', description="Search query, which is assumed to be part of the title."), 
+                 page: int = Query(1, description='Which page of search results should be returned.')):
     '''Search for books in the OpenLibrary API.'''
-    [booksData, total_available] = book_api.search(title, settings.books_per_page, page)
-    for i, b in enumerate(booksData):
-        if 'isbn' in b and len(b['isbn']) > 0 and Book.get_by_isbn(b['isbn'][0]):
-             book = Book.get_by_isbn(b['isbn'][0])
-        else:
-             book = Book(b)
-        booksData[i] = book
-    # Ideally, there'd a single pool, rather than this, which won't scale at all well.
-    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor: #push this higher in the file so there's just one.
-        executor.submit(book_api.search, title, page + 1)
-    return {'books': [b.toDict() for b in booksData],
-            'total_available': total_available}
+    book_api.prefetcher.cancel(title, page, settings.books_per_page) # no need to prefetch what's being fetched now
+    [booksData, total_available] = await book_api.search_async(title, settings.books_per_page, page)
+    books = await books_for_docs(booksData)
+    # start on the next page without making this response wait for it.
+    book_api.prefetcher.schedule(title, page + 1, settings.books_per_page)
+    # the results themselves can change, so they're cached no longer than the search cache keeps them.
+    return json_response(request, b'{"books":' + fast_json.array(b.to_json_bytes() for b in books) +
+                         b',"total_available":' + fast_json.dumps(total_available) + b'}', books,
+                         longest=int(settings.search_cache_ttl))
+
+@app.get('/search/stream')
+async def search_stream(title: str = Query('', description="Search query, which is assumed to be part of the title."),
+                        page: int = Query(1, description='Which page of search results should be returned.')):
+    """The same search as /search, followed by each book's cover and summary as they become available, all as
+       server-sent events on one connection:
+    ---
+    events:
+        books:   {'books': [...], 'total_available': 38}, exactly as /search would return them
+        cover:   {'isbn': '9780261102385', 'cover_url': 'http://whatever'}
+        summary: {'isbn': '9780261102385', 'summary': 'A very well known book'}
+        done:    {}
+    """
+    book_api.prefetcher.cancel(title, page, settings.books_per_page)
+    return StreamingResponse(streaming.search_events(title, page, settings.books_per_page),
+                             media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.get('/book')
-async def book(isbn: Annotated[list[str], Query(description='ISBN numbers of books to retrieve')] = [], 
-               field: Annotated[list[str], Query(description='Any fields that should be added to the book description.  Current valid values are "cover_url" and "summary".')] = []):
-    """Gathers data about specific books, based on the ISBN numbers sent in.  This currently assumes that the books have already been found
-       by a search.  If an ISBN number has not already been found in a call to /search, this service may return nothing for the book.
+async def book(request: Request,
+               isbn: Annotated[list[str], Query(description='ISBN numbers of books to retrieve')] = [], 
+               field: Annotated[list[str], Query(description='Any fields that should be added to the book description.  Current valid values are "cover_url" and "summary".')] = [],
+               priority: Annotated[Literal['visible', 'prefetch', 'warming'], Query(description='How urgently the summaries are needed.  "visible" books are summarized before all others.')] = 'visible'):
+    """Gathers data about specific books, based on the ISBN numbers sent in.  Books that haven't been found by a call to /search
+       (in this process, at least) are looked up by ISBN, so any worker can answer for any book.  ISBNs that OpenLibrary
+       doesn't know are left out of the response.
+       The X-Enrichment header says, per field, how many books already had it and how many had to be fetched.
     ---
     responses:
         200:
@@ -65,17 +144,38 @@ async def book(isbn: Annotated[list[str], Query(description='ISBN numbers of boo
             examples:
                 application.json: {error: 'Unable to find a book with the ISBN 1234567890'}
     """
-    books = []
-    for isbn_num in isbn:
-        b = Book.get_by_isbn(isbn_num)
-        if b :
-            books.append(b)
-    if field == ['cover_url']:
-        await add_covers_to_books(books)
-    else :    
-        for b in books:
-            await enrich_fields_books_async(books, field)
-    return [b.toDict() for b in books]
+    scheduler.summary_priority.set({v: k for k, v in scheduler.PRIORITY_NAMES.items()}[priority])
+    books = await Book.get_many(isbn)
+    counts = await enrich_books(books, field)
+    # per field, Server-Timing style, e.g. "cover_url;hits=8;joined=0;fetched=2"
+    enrichment = ', '.join(f'{f};' + ';'.join(f'{k}={v}' for k, v in c.items()) for f, c in counts.items())
+    return json_response(request, fast_json.array(b.to_json_bytes() for b in books), books, {'X-Enrichment': enrichment})
+
+@app.get('/book/summary/stream')
+async def summary_stream(isbn: str = Query(description='ISBN number of a book')):
+    """The book's summary as plain text, streamed as the LLM generates it.  Any number of clients can stream the same
+       book's summary at once; they all share the one generation."""
+    b = next(iter(await Book.get_many([isbn])), None)
+    if not b:
+        raise HTTPException(status_code=404, detail=f'Unable to find a book with the ISBN {isbn}')
+    return StreamingResponse(b.stream_summary(settings.model), media_type='text/plain; charset=utf-8',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.get('/stats')
+async def stats():
+    """Counters for the caches and batching in front of OpenLibrary and the LLM."""
+    return {'book_registry': Book.books_by_isbn.stats(),
+            'search_cache': book_api.search_cache.stats(),
+            'prefetch': book_api.prefetcher.stats(),
+            'searches_in_flight': book_api.searches_in_flight.stats(),
+            'book_store': Book.store.stats(),
+            'enrichment': enrichment_stats.stats(),
+            'enrichment_in_flight': Book.in_flight.stats(),
+            'summary_store': summarize_api.summary_store.stats(),
+            'summary_scheduler': summarize_api.summary_scheduler.stats(),
+            'summary_tuner': summarize_api.summary_tuner.stats(),
+            'prompts': summarize_api.prompt_stats.stats(),
+            'cover_batches': book_api.cover_loader.stats()}
 
 @app.get('/')
 async def redirect():
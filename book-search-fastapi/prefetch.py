@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from search_cache import SearchCache, search_key
+
+class PrefetchScheduler:
+    '''Runs searches in the background (e.g. for the next page of results) so they're in the search cache before
+       anyone asks for them, without holding up the response that triggered them.
+
+       Pending prefetches wait in a bounded queue, oldest first.  A search that's already cached, pending or running
+       isn't queued again; when the queue is full the oldest pending prefetch is dropped to make room, and any that
+       have waited longer than max_age seconds are dropped rather than run, since whoever wanted them has likely
+       moved on.'''
+
+    def __init__(self, fetch, cache: SearchCache, max_pending: int, workers: int, max_age: float):
+        self.fetch = fetch # async function(query, page, limit), which is expected to leave its result in cache
+        self.cache = cache
+        self.max_pending = max_pending
+        self.workers = workers
+        self.max_age = max_age
+        self._pending = OrderedDict() # key -> ((query, page, limit), time queued)
+        self._running = set()
+        self._wakeup = None
+        self._tasks = []
+        self.scheduled = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.cancelled = 0
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._pending.clear()
+
+    def schedule(self, query: str, page: int, limit: int):
+        '''Queue a search to be run in the background.  Returns immediately.'''
+        key = search_key(query, page, limit)
+        if key in self._pending or key in self._running or self.cache.has(query, page, limit):
+            self.deduplicated += 1
+            return
+        if not self._tasks:
+            self.start()
+        while len(self._pending) >= self.max_pending:
+            self._pending.popitem(last=False)
+            self.dropped += 1
+        self._pending[key] = ((query, page, limit), time.monotonic())
+        self.scheduled += 1
+        self._wakeup.set()
+
+    def cancel(self, query: str, page: int, limit: int):
+        '''Forget a pending prefetch, e.g. because the search is now being run for real.'''
+        if self._pending.pop(search_key(query, page, limit), None):
+            self.cancelled += 1
+
+    def stats(self):
+        return {'pending': len(self._pending),
+                'running': len(self._running),
+                'scheduled': self.scheduled,
+                'deduplicated': self.deduplicated,
+                'dropped': self.dropped,
+                'cancelled': self.cancelled,
+                'completed': self.completed,
+                'failed': self.failed}
+
+    async def _work(self):
+        while True:
+            while not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            key, (args, queued) = self._pending.popitem(last=False)
+            if time.monotonic() - queued > self.max_age:
+                self.dropped += 1
+                continue
+            self._running.add(key)
+            try:
+                await self.fetch(*args)
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed += 1
+                logging.exception(f'Prefetch of {args} failed:')
+            finally:
+                self._running.discard(key)
@@ -0,0 +1,67 @@
+import json
+import re
+import unicodedata
+
+# The fields of a book that are worth sending to the LLM.  Anything else (isbn, cover_url, ...) just produces nonsense.
+PROMPT_FIELDS = ['authors', 'formats', 'publish_year', 'title']
+
+def book_payload(book: dict, max_list_items: int) -> str:
+    '''The book as the LLM should see it: only the useful fields, with the formats canonicalized and deduplicated
+       ("Paperback", "paperback" and "[paperback]" are all just "paperback"), lists cut to max_list_items, and encoded
+       as compact JSON, so that no prompt tokens are spent on whitespace or repetition.'''
+    payload = {}
+    for field in PROMPT_FIELDS:
+        value = book.get(field)
+        if field == 'formats' and value:
+            value = canonical_formats(value)
+        if isinstance(value, list):
+            value = value[:max_list_items]
+        if value:
+            payload[field] = value
+    return json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+def canonical_formats(formats: list[str]) -> list[str]:
+    '''Formats normalized to lower case without brackets or stray punctuation, in order of first appearance, each
+       only once.'''
+    seen = {}
+    for f in formats:
+        f = unicodedata.normalize('NFKC', f).casefold()
+        f = ' '.join(re.sub(r'[\[\]()/]+', ' ', f).split()).strip(' .,;:')
+        if f and f != 'unknown binding':
+            seen.setdefault(f, None)
+    return list(seen)
+
+def count_tokens(text: str) -> int:
+    '''An estimate of how many tokens text is, close enough to compare prompts by: tokenizers for these models
+       average about one token per word or punctuation mark, and one per four characters of any longer word.'''
+    return sum(max(1, len(piece) // 4) for piece in re.findall(r'\w+|[^\w\s]', text))
+
+class PromptStats:
+    '''How many prompt tokens are being sent to the LLM: our estimate for every request, and the count the backend
+       reports when it does.'''
+
+    def __init__(self):
+        self.requests = 0
+        self.estimated_tokens = 0
+        self.reported_requests = 0
+        self.reported_tokens = 0
+        self.last_estimated = None
+        self.last_reported = None
+
+    def record(self, estimated: int, reported: int = None):
+        self.requests += 1
+        self.estimated_tokens += estimated
+        self.last_estimated = estimated
+        if reported is not None:
+            self.reported_requests += 1
+            self.reported_tokens += reported
+            self.last_reported = reported
+
+    def stats(self):
+        return {'requests': self.requests,
+                'estimated_tokens': self.estimated_tokens,
+                'estimated_tokens_mean': self.estimated_tokens / self.requests if self.requests else None,
+                'last_estimated': self.last_estimated,
+                'reported_tokens': self.reported_tokens,
+                'reported_tokens_mean': self.reported_tokens / self.reported_requests if self.reported_requests else None,
+                'last_reported': self.last_reported}
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import re
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+
+from ollama import AsyncClient
+from openai import AsyncOpenAI
+
+from config import settings
+
+@dataclass
+class Completion:
+    text: str
+    prompt_tokens: int = None
+    output_tokens: int = None
+
+class SummaryProvider(ABC):
+    '''An LLM that summaries can be generated with.  Both methods take chat-style messages
+       ([{'role': 'user', 'content': '...'}]); complete returns the whole response, stream yields it in pieces.
+       Providers are created once per model (see get_provider), so their clients and connections are reused.'''
+
+    def __init__(self, model: str):
+        self.model = model
+
+    @abstractmethod
+    async def complete(self, messages: list[dict]) -> Completion:
+        ...
+
+    @abstractmethod
+    def stream(self, messages: list[dict]):
+        '''An async iterator of the response's pieces, so implement it as an async generator.'''
+
+    async def warm(self, messages: list[dict]):
+        '''Prepare for requests starting with messages, e.g. by loading the model.  By default, nothing to do.'''
+
+class OllamaProvider(SummaryProvider):
+    def __init__(self, model: str):
+        super().__init__(model)
+        self.client = AsyncClient(host=settings.ollama_host, timeout=settings.llm_timeout)
+
+    async def complete(self, messages: list[dict]) -> Completion:
+        response = await self.client.chat(model=self.model, messages=messages, keep_alive=settings.ollama_keep_alive)
+        return Completion(response.message.content, response.prompt_eval_count, response.eval_count)
+
+    async def stream(self, messages: list[dict]):
+        async for part in await self.client.chat(model=self.model, messages=messages, stream=True,
+                                                 keep_alive=settings.ollama_keep_alive):
+            yield part.message.content
+
+    async def warm(self, messages: list[dict]):
+        # loads the model (and keeps it loaded), and leaves the prompt prefix in ollama's cache.
+        await self.client.chat(model=self.model, messages=messages, options={'num_predict': 1},
+                               keep_alive=settings.ollama_keep_alive)
+
+    async def unload(self):
+        await self.client.chat(model=self.model, messages=[], keep_alive=0)
+
+class OpenAIProvider(SummaryProvider):
+    def __init__(self, model: str):
+        super().__init__(model)
+        self.client = AsyncOpenAI(timeout=settings.llm_timeout)
+
+    async def complete(self, messages: list[dict]) -> Completion:
+        response = await self.client.responses.create(model=self.model, input=messages)
+        usage = response.usage
+        return Completion(response.output_text,
+                          usage.input_tokens if usage else None,
+                          usage.output_tokens if usage else None)
+
+    async def stream(self, messages: list[dict]):
+        stream = await self.client.responses.create(model=self.model, input=messages, stream=True)
+        async for event in stream:
+            if event.type == 'response.output_text.delta':
+                yield event.delta
+
+class LocalProvider(SummaryProvider):
+    '''A stand-in for a real LLM, for tests and for running without one: "summarizes" the first JSON object in the
+       prompt by stating its title and authors (or, given a JSON array of books, answers with a JSON array of such
+       summaries), taking seconds_per_token per word to do so.  Used for any model whose name starts with "local".'''
+
+    def __init__(self, model: str, seconds_per_token: float = 0):
+        super().__init__(model)
+        self.seconds_per_token = seconds_per_token
+
+    async def complete(self, messages: list[dict]) -> Completion:
+        words = [word async for word in self.stream(messages)]
+        return Completion(''.join(words), len(' '.join(m['content'] for m in messages).split()), len(words))
+
+    async def stream(self, messages: list[dict]):
+        for word in re.findall(r'\S+\s*', self._summarize(messages[-1]['content'])):
+            await asyncio.sleep(self.seconds_per_token)
+            yield word
+
+    def _summarize(self, prompt: str) -> str:
+        try:
+            start = min(i for i in (prompt.find('{'), prompt.find('[')) if i >= 0)
+            data = json.JSONDecoder().raw_decode(prompt[start:])[0]
+        except ValueError:
+            return 'A book.'
+        if isinstance(data, list):
+            return json.dumps([self._summarize_book(book) for book in data])
+        return self._summarize_book(data)
+
+    def _summarize_book(self, book: dict) -> str:
+        authors = ' and '.join(book.get('authors', [])) or 'an unknown author'
+        return f"{book.get('title', 'This book')} is a book by {authors}."
+
+_providers = {}
+
+def get_provider(model: str) -> SummaryProvider:
+    '''The provider for a model, created the first time it's asked for.'''
+    if model not in _providers:
+        if model.startswith('gpt'):
+            _providers[model] = OpenAIProvider(model)
+        elif model.startswith('local'):
+            _providers[model] = LocalProvider(model, settings.local_seconds_per_token)
+        else:
+            _providers[model] = OllamaProvider(model)
+    return _providers[model]
@@ -0,0 +1,72 @@
+'''A stand-in for a Redis server, for trying out (and testing) the redis book store without installing Redis.  It speaks
+just enough of the protocol for RedisBookStore: GET, SET (with NX and PX), DEL, PING, SELECT and AUTH, on data kept in
+memory and lost when it stops.  It's one process, so it's no use for anything but workers on the same host.
+
+    python resp_stand_in.py --port 6379
+    BOOK_STORE_URL=redis://127.0.0.1:6379 uvicorn main:app --workers 4
+'''
+import argparse
+import socketserver
+import threading
+import time
+
+class RespStandIn(socketserver.ThreadingTCPServer):
+    '''Serves on (host, port); port 0 picks a free one, which is then in server_address.'''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        super().__init__((host, port), RespHandler)
+        self.data = {} # key -> (value, expires or None)
+        self.lock = threading.Lock()
+
+    def live(self, key):
+        value = self.data.get(key)
+        if value and value[1] is not None and value[1] < time.time():
+            del self.data[key]
+            return None
+        return value
+
+    def execute(self, args: list[bytes]) -> bytes:
+        command = args[0].upper()
+        with self.lock:
+            if command == b'GET':
+                value = self.live(args[1])
+                return b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value[0]), value[0])
+            if command == b'SET':
+                options = [a.upper() for a in args[3:]]
+                expires = None
+                if b'PX' in options:
+                    expires = time.time() + int(args[3 + options.index(b'PX') + 1]) / 1000
+                if b'NX' in options and self.live(args[1]):
+                    return b'$-1\r\n'
+                self.data[args[1]] = (args[2], expires)
+                return b'+OK\r\n'
+            if command == b'DEL':
+                return b':%d\r\n' % sum(self.data.pop(key, None) is not None for key in args[1:])
+            if command == b'PING':
+                return b'+PONG\r\n'
+            if command in (b'SELECT', b'AUTH'):
+                return b'+OK\r\n'
+        return b'-ERR unknown command ' + command + b'\r\n'
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            self.wfile.write(self.server.execute(args))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args()
+    with RespStandIn(args.host, args.port) as server:
+        print(f'Serving on {server.server_address[0]}:{server.server_address[1]}')
+        server.serve_forever()
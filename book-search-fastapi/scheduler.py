@@ -0,0 +1,98 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+# Priority classes for summary work, most urgent first.
+VISIBLE = 0   # books on the page a user is looking at
+PREFETCH = 1  # books the user may look at next
+WARMING = 2   # anything done speculatively, e.g. filling the summary store
+PRIORITY_NAMES = {VISIBLE: 'visible', PREFETCH: 'prefetch', WARMING: 'warming'}
+
+# Who the current work is for, and how urgent it is.  Set per request (see main.py), and picked up by any tasks
+# started while handling it.
+summary_priority = ContextVar('summary_priority', default=VISIBLE)
+summary_user = ContextVar('summary_user', default=None)
+
+class SummaryScheduler:
+    '''Decides which summary generation runs next, so the LLM backend gets at most `limit` at a time no matter how
+       many users are asking.  Waiting work runs in order of priority class, then fairly across users within a class
+       (each user's jobs take successive turns, so one user asking for 20 summaries doesn't hold up another asking for
+       one), then in order of arrival.'''
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.running = 0
+        self._waiting = []           # heap of (priority, turn, serial, user, future, time queued)
+        self._serial = itertools.count()
+        self._virtual_time = 0       # the turn of the job most recently started
+        self._last_turn = {}         # user -> turn of their most recently queued job
+        self._waits = deque(maxlen=1000)
+        self.started = {name: 0 for name in PRIORITY_NAMES.values()}
+
+    @asynccontextmanager
+    async def slot(self, priority: int = None, user = None):
+        '''Wait for a turn to run, and hold it for the duration of the with block.'''
+        priority = summary_priority.get() if priority is None else priority
+        user = summary_user.get() if user is None else user
+        await self._acquire(priority, user)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def set_limit(self, limit: int):
+        '''Change how many can run at once.  Lowering it doesn't stop anything already running.'''
+        self.limit = limit
+        self._dispatch()
+
+    def stats(self):
+        waits = sorted(self._waits)
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for job in self._waiting:
+            if not job[4].done():
+                depth[PRIORITY_NAMES[job[0]]] += 1
+        return {'limit': self.limit,
+                'running': self.running,
+                'queued': depth,
+                'started': self.started,
+                'wait_seconds_mean': sum(waits) / len(waits) if waits else None,
+                'wait_seconds_p95': waits[int(len(waits) * 0.95)] if waits else None}
+
+    async def _acquire(self, priority: int, user):
+        turn = max(self._virtual_time, self._last_turn.get(user, 0)) + 1
+        self._last_turn[user] = turn
+        if self.running < self.limit and not self._waiting:
+            self._start(priority, turn, 0)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, turn, next(self._serial), user, future, time.monotonic()))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled(): # given a slot just as we gave up, so pass it on
+                self._release()
+            raise
+
+    def _release(self):
+        self.running -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.running < self.limit and self._waiting:
+            priority, turn, _, user, future, queued = heapq.heappop(self._waiting)
+            if future.done(): # cancelled while waiting
+                continue
+            self._start(priority, turn, time.monotonic() - queued)
+            future.set_result(None)
+
+    def _start(self, priority: int, turn: int, waited: float):
+        self.running += 1
+        self._virtual_time = max(self._virtual_time, turn)
+        self._waits.append(waited)
+        self.started[PRIORITY_NAMES[priority]] += 1
+        if len(self._last_turn) > 10000: # forget users who have no turns still to come
+            self._last_turn = {u: t for u, t in self._last_turn.items() if t > self._virtual_time}
@@ -0,0 +1,71 @@
+import json
+import threading
+import unicodedata
+
+from cachetools import TTLCache
+
+def normalize_query(query: str) -> str:
+    '''Fold away differences between queries that OpenLibrary treats as the same search: Unicode normal form,
+       case and whitespace.'''
+    return ' '.join(unicodedata.normalize('NFKC', query or '').casefold().split())
+
+def search_key(query: str, page: int, limit: int) -> tuple:
+    return (normalize_query(query), int(page), int(limit))
+
+def result_size(result) -> int:
+    '''The size of a search result as compact JSON, in bytes.'''
+    return len(json.dumps(result, separators=(',', ':')).encode())
+
+class SearchCache(TTLCache):
+    '''Search results keyed by normalized query, page and limit.  Bounded by the total size of the results in bytes
+       (not by their count), and each result expires ttl seconds after it was fetched.'''
+
+    def __init__(self, max_bytes: int, ttl: float):
+        super().__init__(maxsize=max_bytes, ttl=ttl, getsizeof=result_size)
+        self.lock = threading.Lock() # the cache itself isn't thread safe, and the Flask app serves from many threads.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def lookup(self, query: str, page: int, limit: int):
+        '''The cached result for the search, or None.'''
+        with self.lock:
+            result = self.get(search_key(query, page, limit))
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def has(self, query: str, page: int, limit: int) -> bool:
+        '''Whether the search is cached, without counting it as a lookup.'''
+        with self.lock:
+            return search_key(query, page, limit) in self
+
+    def store(self, query: str, page: int, limit: int, result):
+        try:
+            with self.lock:
+                self[search_key(query, page, limit)] = result
+        except ValueError: # too big to ever fit
+            pass
+
+    def popitem(self):
+        self.evictions += 1
+        return super().popitem()
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        self.expirations += len(expired)
+        return expired
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'entries': len(self),
+                'bytes': self.currsize,
+                'max_bytes': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations}
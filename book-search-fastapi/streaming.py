@@ -0,0 +1,57 @@
+import asyncio
+import json
+
+import book_api
+import fast_json
+from book import Book, books_for_docs
+from config import settings
+
+def sse(event: str, data) -> str:
+    '''Format one server-sent event.  data is encoded as JSON, unless it's bytes, which are taken to be JSON already.'''
+    data = data.decode() if isinstance(data, bytes) else json.dumps(data)
+    return f'event: {event}\ndata: {data}\n\n'
+
+async def search_events(title: str, page: int, limit: int):
+    '''Server-sent events for a search: the books themselves straight away, then a cover or summary event for each
+       book as soon as it's available, then done.
+
+       Covers and summaries are produced into a bounded queue, so if the client reads slowly the enrichment waits for
+       it rather than piling up events in memory.  If the client goes away, the enrichment for this stream is
+       cancelled, though work shared with other requests (see Book.in_flight) carries on for them.'''
+    docs, total_available = await book_api.search_async(title, limit, page)
+    books = await books_for_docs(docs)
+    book_api.prefetcher.schedule(title, page + 1, limit)
+    yield sse('books', b'{"books":' + fast_json.array(b.to_json_bytes() for b in books) +
+                       b',"total_available":' + fast_json.dumps(total_available) + b'}')
+
+    events = asyncio.Queue(maxsize=settings.stream_max_queued_events)
+    summary_limit = asyncio.Semaphore(settings.stream_summary_concurrency)
+
+    async def add_cover(book: Book):
+        url = await Book.in_flight.do((book.flight_key, 'cover_url'), Book.book_api.cover_url_async, book.isbn)
+        if url and book.cover_url == None:
+            book.set_cover_url(url)
+        if book.cover_url:
+            await events.put(('cover', {'isbn': book.isbn, 'cover_url': book.cover_url}))
+
+    async def add_summary(book: Book):
+        async with summary_limit:
+            await book.add_summary(settings.model)
+        if book.summary:
+            await events.put(('summary', {'isbn': book.isbn, 'summary': book.summary}))
+
+    async def enrich():
+        tasks = [add_cover(b) for b in books if b.isbn and b.cover_url == None]
+        tasks += [add_summary(b) for b in books if b.summary == None]
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for b in books:
+            b.fully_enriched = bool(b.cover_url and b.summary)
+        await events.put(None)
+
+    enrichment = asyncio.create_task(enrich())
+    try:
+        while (event := await events.get()) is not None:
+            yield sse(*event)
+        yield sse('done', {})
+    finally:
+        enrichment.cancel()
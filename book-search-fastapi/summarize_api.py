@@ -1,59 +1,187 @@
 import asyncio
+import json as jsonlib
+import logging
+import time
 from typing import List
-from ollama import ChatResponse, AsyncClient, chat
+from ollama import ChatResponse, chat
 from openai import OpenAI
+
+from config import settings
+from prompt import PromptStats, count_tokens
+from providers import Completion, get_provider
+from scheduler import SummaryScheduler
+from tuner import ConcurrencyTuner
+from summary_store import SummaryStore
      
-PROMPT_TEMPLATE = '''Summarize the information contained in the following JSON object about a book.  
+# The instructions are sent as a system message, separately from the book, and never vary, so each request starts with
+# exactly the same tokens and the backend can reuse its cached work on that prefix rather than reprocessing it.
+SUMMARY_INSTRUCTIONS = '''Summarize the information contained in the JSON object about a book that the user sends.  
             Provide just a paragraph of text, in clear English, 
             summarizing the JSON as one would expect to see on a library or bookstore website, but
             with no other preface or text telling me what you're doing.  Assume all books have already been released.
             Be sure to mention the title and 
-            author upfront. Only use information found in the JSON. {}'''
+            author upfront. Only use information found in the JSON.'''
+
+# For summarizing several books in one request.  Each summary should be just what SUMMARY_INSTRUCTIONS would produce.
+BATCH_SUMMARY_INSTRUCTIONS = '''The user will send a JSON array of objects, each with information about a book.
+            For each book, write a paragraph of text, in clear English, 
+            summarizing its JSON as one would expect to see on a library or bookstore website.  Assume all books have already been released.
+            Be sure to mention the title and 
+            author upfront. Only use information found in that book's JSON.
+            Respond with nothing but a JSON array with exactly one string per book: the summaries, in the same order as the books.'''
+
+# Summaries are expensive, so every one generated is kept, and checked for before calling the LLM.
+summary_store = SummaryStore(settings.summary_store_path)
+# ... and they're generated no faster than the LLM backend can manage, most urgent first.
+summary_scheduler = SummaryScheduler(settings.summary_concurrency)
+# how big the prompts being sent are, since prefill time (and cost) grows with them.
+prompt_stats = PromptStats()
+summary_tuner = ConcurrencyTuner(summary_scheduler, settings.summary_target_p95,
+                                 min_limit=1, max_limit=settings.summary_concurrency_max)
 
 
 def summarize(json: str, model='llama3.2') -> str:
     '''Summarize information contained in a JSON blob about a book, for display to an end user.'''
+    key = SummaryStore.key(model, SUMMARY_INSTRUCTIONS, json)
+    summary = summary_store.get(key)
+    if summary is not None:
+        return summary
     if model.startswith('gpt') :
         client = OpenAI()
         response = client.responses.create(
             model=model,
-            input=PROMPT_TEMPLATE.format(json)
+            input=_messages(json)
         )
-        return response.output_text
+        summary = response.output_text
     else : 
-        message = {
-            'role': 'user',
-            'content': PROMPT_TEMPLATE.format(json),
-        }
-        response: ChatResponse = chat(model, messages=[        
-            message
-        ])
-        return response.message.content
-
-async def summarize_multiple_async(jsons: List[str], model='llama3.2'):
-    tasks = []
-    for json in jsons:
-        tasks.append(summarize_async(json, model))
-    return await asyncio.gather(*tasks) 
+        response: ChatResponse = chat(model, messages=_messages(json), keep_alive=settings.ollama_keep_alive)
+        summary = response.message.content
+    if summary:
+        summary_store.put(key, model, summary)
+    return summary
+
+async def summarize_batch_async(jsons: List[str], model = 'llama3.2') -> List[str]:
+    '''Summarize several books with a single LLM request, which saves repeating the instructions (and the request
+       overhead) for each one.  Summaries already in the store aren't asked for again.  Those generated are stored
+       under the batch instructions, since that's the prompt that produced them.  If the response can't be read as
+       exactly one summary per book, falls back to summarizing each book on its own.'''
+    summaries = [await _stored_summary(json, model) for json in jsons]
+    missing = [i for i, summary in enumerate(summaries) if summary is None]
+    if len(missing) <= 1:
+        for i in missing:
+            summaries[i] = await summarize_async(jsons[i], model)
+        return summaries
+
+    books = '[' + ','.join(jsons[i] for i in missing) + ']'
+    messages = [{'role': 'system', 'content': BATCH_SUMMARY_INSTRUCTIONS},
+                {'role': 'user', 'content': books}]
+    async with summary_scheduler.slot():
+        started = time.monotonic()
+        completion = await _complete(messages, model)
+        _measure(started, completion.output_tokens if completion else 0, len(missing))
+    generated = _parse_batch(completion.text if completion else None, len(missing))
+    if generated is None:
+        logging.warning(f'Unusable batch of {len(missing)} summaries from {model}; summarizing them one at a time.')
+        generated = await asyncio.gather(*[summarize_async(jsons[i], model) for i in missing])
+    else:
+        for i, summary in zip(missing, generated):
+            key = SummaryStore.key(model, BATCH_SUMMARY_INSTRUCTIONS, jsons[i])
+            await asyncio.to_thread(summary_store.put, key, model, summary)
+    for i, summary in zip(missing, generated):
+        summaries[i] = summary
+    return summaries
+
+def _parse_batch(text: str, count: int) -> List[str]:
+    '''The summaries in a batch response, or None unless it's a JSON array of count non-empty strings.'''
+    try:
+        summaries = jsonlib.loads(text[text.index('['):text.rindex(']') + 1])
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if (not isinstance(summaries, list) or len(summaries) != count
+            or not all(isinstance(s, str) and s.strip() for s in summaries)):
+        return None
+    return [s.strip() for s in summaries]
 
 async def summarize_async(json: str, model = 'llama3.2') -> str:
-    '''An async function to summarize information contained in a JSON blob about a book, for display to an end user.'''
-    if model.startswith('gpt') :
-        print("Summarizing " + json + " via OpenAI.")
-        client = OpenAI()
-        response = client.responses.create(
-            model=model,
-            input=PROMPT_TEMPLATE.format(json)
-        )
-        return response.output_text
-    else :
-        message = {
-                'role': 'user',
-                'content': PROMPT_TEMPLATE.format(json),
-            }
-        try:
-            response = await AsyncClient().chat(model=model, messages=[message])
-            return response.message.content
-        except Exception as e:
-            # should probably log something...
-            return None
+    '''An async function to summarize information contained in a JSON blob about a book, for display to an end user.
+       Previously generated summaries come from the summary store rather than the LLM.'''
+    summary = await _stored_summary(json, model)
+    if summary is not None:
+        return summary
+    key = SummaryStore.key(model, SUMMARY_INSTRUCTIONS, json)
+    async with summary_scheduler.slot():
+        started = time.monotonic()
+        completion = await _generate_async(json, model)
+        _measure(started, completion.output_tokens if completion else 0)
+    summary = completion.text if completion else None
+    if summary:
+        await asyncio.to_thread(summary_store.put, key, model, summary)
+    return summary
+
+async def _stored_summary(json: str, model: str) -> str:
+    '''A summary of the book already in the store, whether it was generated on its own or as part of a batch.'''
+    keys = [SummaryStore.key(model, instructions, json) for instructions in (SUMMARY_INSTRUCTIONS, BATCH_SUMMARY_INSTRUCTIONS)]
+    return await asyncio.to_thread(summary_store.get_any, keys)
+
+async def _generate_async(json: str, model: str) -> Completion:
+    return await _complete(_messages(json), model)
+
+async def _complete(messages: list[dict], model: str) -> Completion:
+    estimated_tokens = _prompt_tokens(messages)
+    try:
+        completion = await get_provider(model).complete(messages)
+        prompt_stats.record(estimated_tokens, completion.prompt_tokens)
+        logging.debug(f'Prompt of ~{estimated_tokens} tokens ({completion.prompt_tokens} reported) to {model}')
+        if completion.output_tokens is None:
+            completion.output_tokens = len(completion.text or '') // 4 # a rough rule of thumb for English
+        return completion
+    except Exception as e:
+        logging.exception(f'Unable to summarize via {model}:')
+        return None
+
+async def summarize_stream(json: str, model = 'llama3.2'):
+    '''Like summarize_async, but yields the summary a piece at a time as the LLM generates it, so the first words can be
+       shown long before the whole paragraph is done.  A stored summary is yielded all at once.'''
+    summary = await _stored_summary(json, model)
+    if summary is not None:
+        yield summary
+        return
+    key = SummaryStore.key(model, SUMMARY_INSTRUCTIONS, json)
+    tokens = []
+    async with summary_scheduler.slot():
+        started = time.monotonic()
+        async for token in _generate_stream(json, model):
+            tokens.append(token)
+            yield token
+        _measure(started, len(tokens)) # streamed chunks are about a token each
+    if tokens:
+        await asyncio.to_thread(summary_store.put, key, model, ''.join(tokens))
+
+async def _generate_stream(json: str, model: str):
+    messages = _messages(json)
+    prompt_stats.record(_prompt_tokens(messages))
+    async for token in get_provider(model).stream(messages):
+        yield token
+
+def _measure(started: float, output_tokens: int, books: int = 1):
+    # the tuner's target is per summary, so a batch counts as that many summaries, each taking its share of the time.
+    if settings.summary_autotune:
+        latency = time.monotonic() - started
+        for _ in range(books):
+            summary_tuner.record(latency / books, (output_tokens or 0) / books)
+
+def _prompt_tokens(messages: list[dict]) -> int:
+    return sum(count_tokens(m['content']) for m in messages)
+
+def _messages(json: str) -> list[dict]:
+    return [{'role': 'system', 'content': SUMMARY_INSTRUCTIONS},
+            {'role': 'user', 'content': json}]
+
+async def warm_up(model: str):
+    '''Get the model loaded, with the instructions already processed, before the first real request needs it.'''
+    try:
+        started = time.monotonic()
+        await get_provider(model).warm(_messages('{}'))
+        logging.info(f'Warmed up {model} in {time.monotonic() - started:.1f}s')
+    except Exception:
+        logging.exception(f'Unable to warm up {model}:')
@@ -0,0 +1,66 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+class SummaryStore:
+    '''A durable home for LLM summaries, so they survive restarts and deploys.  Summaries are kept in a local SQLite
+       file (in WAL mode, so readers never wait on the writer), keyed by a hash of everything that determines the
+       summary: the model, the prompt template and the exact book JSON sent to the model.'''
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local() # sqlite connections can't be shared across threads, so each gets its own.
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    @staticmethod
+    def key(model: str, prompt_template: str, json: str) -> str:
+        return hashlib.sha256('\0'.join([model, prompt_template, json]).encode()).hexdigest()
+
+    def get(self, key: str) -> str:
+        row = self._connection().execute('SELECT summary FROM summaries WHERE key = ?', (key,)).fetchone()
+        if row:
+            self.hits += 1
+            return row[0]
+        self.misses += 1
+        return None
+
+    def get_any(self, keys: list[str]) -> str:
+        '''The summary stored under the first of keys that has one, if any, as a single lookup.'''
+        rows = dict(self._connection().execute(f'SELECT key, summary FROM summaries WHERE key IN ({",".join("?" * len(keys))})',
+                                               keys).fetchall())
+        for key in keys:
+            if key in rows:
+                self.hits += 1
+                return rows[key]
+        self.misses += 1
+        return None
+
+    def put(self, key: str, model: str, summary: str):
+        with self._connection() as db:
+            db.execute('INSERT OR REPLACE INTO summaries (key, model, summary, created) VALUES (?, ?, ?, ?)',
+                       (key, model, summary, time.time()))
+        self.writes += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'writes': self.writes}
+
+    def _connection(self) -> sqlite3.Connection:
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('''CREATE TABLE IF NOT EXISTS summaries (
+                              key TEXT PRIMARY KEY,
+                              model TEXT NOT NULL,
+                              summary TEXT NOT NULL,
+                              created REAL NOT NULL)''')
+            self._local.db = db
+        return db
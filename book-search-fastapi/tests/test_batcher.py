@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from batcher import BatchLoader
+
+def make_loader(window = 0.01, max_batch_size = 100, fail = False):
+    calls = []
+
+    async def batch_fn(keys):
+        calls.append(keys)
+        if fail:
+            raise RuntimeError('upstream down')
+        return {key: key.upper() for key in keys if key != 'missing'}
+
+    return BatchLoader(batch_fn, window, max_batch_size), calls
+
+@pytest.mark.anyio
+async def test_keys_asked_for_together_are_loaded_in_one_call():
+    loader, calls = make_loader()
+    results = await asyncio.gather(loader.load('a'), loader.load('b'), loader.load_many(['c', 'a']))
+    assert results == ['A', 'B', ['C', 'A']]
+    assert calls == [['a', 'b', 'c']] # a only once
+    assert loader.stats() == {'batches': 1, 'keys_requested': 4, 'keys_loaded': 3, 'pending': 0}
+
+@pytest.mark.anyio
+async def test_missing_and_none_keys_load_as_none():
+    loader, calls = make_loader()
+    assert await loader.load_many(['missing', None]) == [None, None]
+    assert calls == [['missing']]
+
+@pytest.mark.anyio
+async def test_a_full_batch_is_sent_without_waiting():
+    loader, calls = make_loader(window=60, max_batch_size=2)
+    assert await asyncio.wait_for(loader.load_many(['a', 'b', 'c', 'd']), 1) == ['A', 'B', 'C', 'D']
+    assert calls == [['a', 'b'], ['c', 'd']]
+
+@pytest.mark.anyio
+async def test_a_failed_batch_fails_every_caller():
+    loader, calls = make_loader(fail=True)
+    results = await asyncio.gather(loader.load('a'), loader.load('b'), return_exceptions=True)
+    assert [type(r) for r in results] == [RuntimeError, RuntimeError]
+    assert len(calls) == 1
+
+@pytest.mark.anyio
+async def test_one_caller_giving_up_leaves_the_others_their_result():
+    loader, calls = make_loader()
+    impatient = asyncio.ensure_future(loader.load('a'))
+    patient = asyncio.ensure_future(loader.load('a'))
+    await asyncio.sleep(0)
+    impatient.cancel()
+    assert await patient == 'A'
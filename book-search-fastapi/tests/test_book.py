@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+from book import Book, book_size, enrich_books
+
+def test_book_size_ignores_the_cached_json():
+    book = Book({'title': 'Sized', 'author_name': ['Someone'], 'isbn': ['sized']}, share=False)
+    size = book_size(book)
+    book.to_json_bytes()
+    assert book_size(book) == size
+    book.set_summary('A summary long enough to be noticed in the size of the book.')
+    assert book_size(book) > size
+
+@pytest.mark.anyio
+async def test_enriching_an_enriched_book_again_keeps_its_json():
+    book = Book({'title': 'Cached', 'author_name': ['Someone'], 'isbn': ['cached-json'], 'summary': 'Summed up.',
+                 'cover_url': 'https://covers.openlibrary.org/b/id/1-S.jpg'}, share=False)
+    await enrich_books([book], ['cover_url', 'summary'])
+    encoded = book.to_json_bytes()
+    for _ in range(3):
+        await enrich_books([book], ['cover_url', 'summary'])
+        assert book.to_json_bytes() is encoded
+
+def test_assigning_the_same_value_is_not_a_change():
+    book = Book({'title': 'Unchanged', 'isbn': ['unchanged']}, share=False)
+    version = book.version
+    book.title = 'Unchanged'
+    assert book.version == version
+    book.title = 'Changed'
+    assert book.version == version + 1
+
+def test_the_work_is_shared_by_its_editions_but_not_sent():
+    first = Book({'title': 'Worked', 'isbn': ['worked-1'], 'key': '/works/OL1W'}, share=False)
+    assert Book.find({'title': 'Worked', 'isbn': ['worked-2'], 'key': '/works/OL1W'}) is first
+    assert json.loads(first.to_json_bytes()) == {'title': 'Worked', 'isbn': 'worked-1'}
+    assert first.to_doc()['key'] == '/works/OL1W' # still shared with other workers, though
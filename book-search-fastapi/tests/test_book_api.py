@@ -0,0 +1,96 @@
+import pytest
+from aiohttp import web
+
+import book_api
+from book import Book, enrich_books
+
+EDITIONS = {'9780261102385': {'title': 'The Lord of the Rings', 'authors': [{'name': 'J.R.R. Tolkien'}],
+                              'publish_date': 'Oct 1991', 'works': [{'key': '/works/OL27448W'}],
+                              'identifiers': {'isbn_10': ['0261102389'], 'isbn_13': ['9780261102385']},
+                              'cover': {'small': 'https://covers.openlibrary.org/b/id/1-S.jpg'}}}
+
+@pytest.fixture
+async def openlibrary(monkeypatch):
+    '''A stand-in for the books API, which records the bibkeys of every call made to it.'''
+    calls = []
+
+    async def books(request):
+        keys = request.query['bibkeys'].split(',')
+        calls.append(keys)
+        if request.query.get('jscmd') != 'data': # just the bibliographic summary, which is all cover lookups need
+            return web.json_response({key: {'bib_key': key, 'thumbnail_url': EDITIONS[key[5:]]['cover']['small']}
+                                      for key in keys if key[5:] in EDITIONS})
+        return web.json_response({key: EDITIONS[key[5:]] for key in keys if key[5:] in EDITIONS})
+
+    app = web.Application()
+    app.add_routes([web.get('/api/books', books)])
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    monkeypatch.setattr(book_api.settings, 'open_library_url', f'http://127.0.0.1:{port}')
+    book_api.missing_isbns.clear()
+    yield calls
+    await book_api.close_session()
+    await runner.cleanup()
+
+@pytest.mark.anyio
+async def test_books_are_looked_up_by_isbn(openlibrary):
+    [doc] = await book_api.books_by_isbn_async(['978-0-261-10238-5'])
+    assert doc['title'] == 'The Lord of the Rings'
+    assert doc['author_name'] == ['J.R.R. Tolkien']
+    assert doc['first_publish_year'] == 1991
+    assert doc['key'] == '/works/OL27448W'
+    assert '0261102389' in doc['isbn']
+
+@pytest.mark.anyio
+async def test_invalid_isbns_are_not_sent(openlibrary):
+    assert await book_api.books_by_isbn_async(['not an isbn', '9780261102386']) == [None, None]
+    assert openlibrary == []
+
+@pytest.mark.anyio
+async def test_unknown_isbns_are_remembered(openlibrary):
+    unknown = '9780306406157'
+    assert await book_api.books_by_isbn_async([unknown]) == [None]
+    assert await book_api.books_by_isbn_async([unknown]) == [None]
+    assert openlibrary == [[f'ISBN:{unknown}']]
+
+@pytest.mark.anyio
+async def test_both_forms_of_an_isbn_are_one_lookup(openlibrary):
+    docs = await book_api.books_by_isbn_async(['0261102389', '9780261102385'])
+    assert docs[0] == docs[1]
+    assert openlibrary == [['ISBN:9780261102385']]
+
+@pytest.mark.anyio
+async def test_get_many_builds_and_keeps_books(openlibrary):
+    books = await Book.get_many(['0261102389', 'bogus'])
+    assert [b.title for b in books] == ['The Lord of the Rings']
+    assert Book.get_by_isbn('9780261102385') is books[0]
+    assert Book.get_by_work('/works/OL27448W') is books[0]
+
+@pytest.mark.parametrize('doc, url', [
+    ({'cover_i': 258027}, 'https://covers.openlibrary.org/b/id/258027-S.jpg'),
+    ({'cover_edition_key': 'OL51711263M'}, 'https://covers.openlibrary.org/b/olid/OL51711263M-S.jpg'),
+    ({'cover_i': 258027, 'cover_edition_key': 'OL51711263M'}, 'https://covers.openlibrary.org/b/id/258027-S.jpg'),
+    ({}, None)])
+def test_cover_url_from_a_search_result(monkeypatch, doc, url):
+    monkeypatch.setattr(book_api.settings, 'covers_url', 'https://covers.openlibrary.org')
+    monkeypatch.setattr(book_api.settings, 'cover_size', 'S')
+    assert book_api.cover_url_from_doc(doc) == url
+
+@pytest.mark.parametrize('cover_from_search', [True, False])
+def test_a_book_takes_its_cover_from_the_search_only_if_configured(monkeypatch, cover_from_search):
+    monkeypatch.setattr(book_api.settings, 'cover_from_search', cover_from_search)
+    book = Book({'title': 'Covered', 'isbn': ['covered'], 'cover_i': 258027}, share=False)
+    assert (book.cover_url is not None) == cover_from_search
+
+@pytest.mark.anyio
+async def test_a_cover_not_in_the_search_is_looked_up(openlibrary, monkeypatch):
+    monkeypatch.setattr(book_api.settings, 'cover_from_search', True)
+    searched = Book({'title': 'The Hobbit', 'isbn': ['9780261102217'], 'cover_i': 258027}, share=False)
+    uncovered = Book({'title': 'The Lord of the Rings', 'isbn': ['9780261102385']}, share=False)
+    assert uncovered.cover_url is None
+    await enrich_books([searched, uncovered], ['cover_url'])
+    assert openlibrary == [['ISBN:9780261102385']] # nothing asked for the book whose search result had a cover
+    assert uncovered.cover_url == 'https://covers.openlibrary.org/b/id/1-S.jpg'
@@ -0,0 +1,156 @@
+import asyncio
+import threading
+
+import pytest
+
+import book
+from book import Book, books_for_docs, enrich_books
+from book_store import BookStore, get_book_store
+from resp_stand_in import RespStandIn
+
+@pytest.fixture(scope='module')
+def resp_server():
+    with RespStandIn() as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def store(request, tmp_path, resp_server) -> BookStore:
+    if request.param == 'sqlite':
+        return get_book_store(f'sqlite:///{tmp_path / "books.sqlite3"}')
+    if request.param == 'redis':
+        resp_server.data.clear()
+        host, port = resp_server.server_address
+        return get_book_store(f'redis://{host}:{port}/0')
+    return get_book_store('memory')
+
+@pytest.fixture
+def shared_store(store, monkeypatch) -> BookStore:
+    '''store, as Book's, with the books seen so far forgotten, as in a new worker.'''
+    if not store.shared:
+        pytest.skip('the in-process store shares nothing')
+    monkeypatch.setattr(Book, 'store', store)
+    for key in list(Book.books_by_isbn):
+        del Book.books_by_isbn[key]
+    return store
+
+def flush_writes():
+    book._store_writer.submit(lambda: None).result()
+
+DOC = {'title': 'The Hobbit', 'author_name': ['J.R.R. Tolkien'], 'isbn': ['9780261102217', '0261102214'],
+       'key': '/works/OL262758W'}
+
+def test_put_and_get(store):
+    store.put('9780261102217', DOC, ['0261102214', '/works/OL262758W'])
+    if not store.shared:
+        assert store.get('9780261102217') is None
+        return
+    assert store.get('9780261102217') == DOC
+    assert store.get('0261102214') == DOC
+    assert store.get('/works/OL262758W') == DOC
+    assert store.get('9780000000002') is None
+    assert store.stats()['hits'] == 3 and store.stats()['misses'] == 1
+
+def test_a_claim_is_held_until_released(store):
+    assert store.claim('hobbit:summary', 60)
+    if store.shared:
+        assert not store.claim('hobbit:summary', 60)
+        assert store.stats()['claims_lost'] == 1
+    store.release('hobbit:summary')
+    assert store.claim('hobbit:summary', 60)
+
+def test_a_claim_expires(store):
+    assert store.claim('hobbit:cover', 0.05)
+    threading.Event().wait(0.1)
+    assert store.claim('hobbit:cover', 60)
+
+def test_the_in_process_store_is_not_shared():
+    assert not get_book_store('memory').shared
+    with pytest.raises(ValueError):
+        get_book_store('carrier-pigeon://loft')
+
+@pytest.mark.anyio
+async def test_books_are_found_in_the_store_by_another_worker(shared_store):
+    Book(dict(DOC, summary='A hobbit goes there and back again.'))
+    flush_writes()
+    for key in list(Book.books_by_isbn):
+        del Book.books_by_isbn[key]
+    [found] = await Book.get_many(['0-261-10221-4'])
+    assert found.summary == 'A hobbit goes there and back again.'
+    assert Book.get_by_isbn('0261102214') is found
+
+@pytest.mark.anyio
+async def test_search_results_reuse_books_from_the_store(shared_store):
+    Book(dict(DOC, cover_url='https://covers.openlibrary.org/b/id/1-S.jpg'))
+    flush_writes()
+    for key in list(Book.books_by_isbn):
+        del Book.books_by_isbn[key]
+    [found] = await books_for_docs([{'title': 'The Hobbit', 'key': '/works/OL262758W', 'isbn': ['0261102214']}])
+    assert found.cover_url == 'https://covers.openlibrary.org/b/id/1-S.jpg'
+
+@pytest.mark.anyio
+async def test_a_stream_waits_for_another_workers_summary(shared_store, monkeypatch):
+    monkeypatch.setattr(book.settings, 'book_store_poll_interval', 0.01)
+    hobbit = Book(dict(DOC))
+    flush_writes()
+    assert shared_store.claim(f'{hobbit.flight_key}:summary', 60) # as another worker would, before generating it
+
+    async def other_worker():
+        await asyncio.sleep(0.05)
+        shared_store.put(str(hobbit.flight_key), dict(DOC, summary='Written elsewhere.'))
+        shared_store.release(f'{hobbit.flight_key}:summary')
+
+    other = asyncio.ensure_future(other_worker())
+    pieces = [piece async for piece in hobbit.stream_summary('local')]
+    await other
+    assert pieces == ['Written elsewhere.']
+    assert hobbit.summary == 'Written elsewhere.'
+
+@pytest.mark.anyio
+async def test_a_stream_shares_its_summary_and_releases_its_claim(shared_store):
+    hobbit = Book(dict(DOC))
+    pieces = [piece async for piece in hobbit.stream_summary('local')]
+    flush_writes()
+    assert ''.join(pieces) == hobbit.summary
+    assert shared_store.get(hobbit.flight_key)['summary'] == hobbit.summary
+    assert shared_store.claim(f'{hobbit.flight_key}:summary', 60)
+
+@pytest.mark.anyio
+async def test_enrich_books_leaves_summaries_claimed_elsewhere_to_their_worker(shared_store, monkeypatch):
+    monkeypatch.setattr(book.settings, 'book_store_poll_interval', 0.01)
+    hobbit, other = Book(dict(DOC)), Book({'title': 'Unclaimed', 'author_name': ['Someone'], 'isbn': ['unclaimed']})
+    assert shared_store.claim(f'{hobbit.flight_key}:summary', 60)
+
+    async def other_worker():
+        await asyncio.sleep(0.05)
+        shared_store.put(str(hobbit.flight_key), dict(DOC, summary='Written elsewhere.'))
+        shared_store.release(f'{hobbit.flight_key}:summary')
+
+    elsewhere = asyncio.ensure_future(other_worker())
+    await enrich_books([hobbit, other], ['summary'])
+    await elsewhere
+    assert hobbit.summary == 'Written elsewhere.'
+    assert other.summary == 'Unclaimed is a book by Someone.'
+
+@pytest.mark.anyio
+async def test_streams_on_one_worker_share_a_generation(shared_store):
+    hobbit = Book(dict(DOC, title=f'The Hobbit, streamed from {type(shared_store).__name__}')) # not summarized yet
+
+    async def listen():
+        return [piece async for piece in hobbit.stream_summary('local')]
+
+    first, second = await asyncio.gather(listen(), listen())
+    assert len(first) > 1 # streamed, not handed over whole once another worker's claim was released
+    assert second == first
+
+@pytest.mark.anyio
+async def test_a_summary_shared_just_before_the_claim_is_not_generated_again(shared_store):
+    hobbit = Book(dict(DOC))
+    flush_writes()
+    shared_store.put(str(hobbit.flight_key), dict(DOC, summary='Written elsewhere.'))
+    pieces = [piece async for piece in hobbit.stream_summary('local')]
+    flush_writes()
+    assert pieces == ['Written elsewhere.']
+    assert shared_store.claim(f'{hobbit.flight_key}:summary', 60)
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+import summarize_api
+from book import Book
+from broadcast import TokenBroadcast
+
+def gated_source(tokens: list[str], gate: asyncio.Event, started: list):
+    '''Yields tokens, the first straight away and the rest once gate is set.'''
+    async def source():
+        started.append(True)
+        for i, token in enumerate(tokens):
+            if i:
+                await gate.wait()
+            yield token
+    return source()
+
+async def read(broadcast: TokenBroadcast):
+    return [token async for token in broadcast.subscribe()]
+
+@pytest.mark.anyio
+async def test_every_subscriber_gets_every_token_from_one_generation():
+    gate, started, completed = asyncio.Event(), [], []
+    broadcast = TokenBroadcast(gated_source(['Once ', 'upon ', 'a time.'], gate, started), completed.append)
+    early = [asyncio.ensure_future(read(broadcast)) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    late = asyncio.ensure_future(read(broadcast)) # joins after the first token
+    gate.set()
+    results = await asyncio.gather(*early, late)
+    assert results == [['Once ', 'upon ', 'a time.']] * 4
+    after = await read(broadcast) # joins after the end
+    assert after == ['Once ', 'upon ', 'a time.']
+    assert started == [True]
+    assert completed == ['Once upon a time.']
+    assert await broadcast.result() == 'Once upon a time.'
+
+@pytest.mark.anyio
+async def test_a_failed_generation_ends_every_subscriber():
+    async def source():
+        yield 'Once '
+        raise RuntimeError('the LLM went away')
+
+    completed = []
+    broadcast = TokenBroadcast(source(), completed.append)
+    results = await asyncio.gather(read(broadcast), read(broadcast))
+    assert results == [['Once ']] * 2
+    assert completed == [None]
+    assert await broadcast.result() is None
+
+@pytest.mark.anyio
+async def test_a_books_summary_is_streamed_once_to_everyone():
+    book = Book({'title': 'Broadcast', 'author_name': ['Someone'], 'isbn': ['broadcast']}, share=False)
+    requests = summarize_api.prompt_stats.requests
+
+    async def listen(delay: float):
+        await asyncio.sleep(delay)
+        return [piece async for piece in book.stream_summary('local')]
+
+    results = await asyncio.gather(listen(0), listen(0), listen(0.001))
+    assert results[0] == results[1] == results[2]
+    assert len(results[0]) > 1
+    assert ''.join(results[0]) == book.summary == 'Broadcast is a book by Someone.'
+    assert summarize_api.prompt_stats.requests == requests + 1
+    assert [piece async for piece in book.stream_summary('local')] == [book.summary] # and kept once it's done
@@ -0,0 +1,17 @@
+import pytest
+
+from isbn import canonical_isbn, isbn10_to_13
+
+def test_both_forms_are_the_same():
+    assert canonical_isbn('0261102389') == canonical_isbn('9780261102385') == 9780261102385
+
+def test_hyphens_and_spaces_are_ignored():
+    assert canonical_isbn('978-0-261-10238-5') == canonical_isbn('0 261 10238 9') == 9780261102385
+
+def test_an_x_check_digit():
+    assert canonical_isbn('080442957x') == canonical_isbn('080442957X') == int(isbn10_to_13('080442957X'))
+
+@pytest.mark.parametrize('isbn', ['9780261102386', '0261102388', '026110238', '97802611023851', 'abcdefghij', '',
+                                  '/works/OL27448W'])
+def test_anything_else_is_not_an_isbn(isbn):
+    assert canonical_isbn(isbn) is None
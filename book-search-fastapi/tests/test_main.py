@@ -0,0 +1,63 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import pytest
+from fastapi import Request
+from fastapi.testclient import TestClient
+
+import main
+import summarize_api
+from book import Book
+
+def test_warm_up_still_running_is_cancelled_at_shutdown(monkeypatch):
+    states = []
+
+    async def slow_warm_up(model):
+        states.append('started')
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            states.append('cancelled')
+            raise
+
+    monkeypatch.setattr(main.settings, 'llm_warm_up', True)
+    monkeypatch.setattr(summarize_api, 'warm_up', slow_warm_up)
+    with TestClient(main.app) as client:
+        client.get('/stats')
+    assert states == ['started', 'cancelled']
+
+def test_search_results_are_cached_no_longer_than_the_search_cache(monkeypatch):
+    monkeypatch.setattr(main.settings, 'search_cache_ttl', 3600)
+    book = Book({'title': 'Cached', 'isbn': ['cached']}, share=False)
+    book.fully_enriched = True
+    request = Request({'type': 'http', 'headers': []})
+    assert main.json_response(request, b'[]', [book]).headers['cache-control'] == 'public, max-age=86400'
+    assert main.json_response(request, b'[]', [book], longest=3600).headers['cache-control'] == 'public, max-age=3600'
+
+@pytest.mark.parametrize('if_none_match, matches', [(None, False), ('', False), ('W/"abc"', True), ('"abc"', True),
+                                                    ('"other", W/"abc"', True), ('*', True), ('"abcd"', False)])
+def test_etag_matches(if_none_match, matches):
+    assert main.etag_matches(if_none_match, 'W/"abc"') == matches
+
+def test_a_book_encodes_the_same_whatever_the_hash_seed():
+    code = ('from book import Book; import sys; sys.stdout.buffer.write(Book({"title": "Seeded", "author_name": ["A"], '
+            '"isbn": ["seeded"], "format": ["Paperback"], "summary": "S", "cover_url": "C"}, share=False).to_json_bytes())')
+    outputs = {subprocess.run([sys.executable, '-c', code], capture_output=True, check=True,
+                              env={**os.environ, 'PYTHONHASHSEED': seed}).stdout
+               for seed in ('1', '2', '3')}
+    assert len(outputs) == 1
+
+def test_search_answers_its_own_etag_with_304(monkeypatch):
+    async def search_async(title, limit, page = 1, session = None):
+        return [[{'title': 'Tagged', 'author_name': ['Someone'], 'isbn': ['tagged'], 'key': '/works/OL1W'}], 1]
+
+    monkeypatch.setattr(main.book_api, 'search_async', search_async)
+    monkeypatch.setattr(main.book_api.prefetcher, 'schedule', lambda *args: None)
+    with TestClient(main.app) as client:
+        first = client.get('/search', params={'title': 'tagged'})
+        assert first.status_code == 200
+        again = client.get('/search', params={'title': 'tagged'}, headers={'If-None-Match': first.headers['etag']})
+    assert again.status_code == 304
+    assert again.headers['etag'] == first.headers['etag']
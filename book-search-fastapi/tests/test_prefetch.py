@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from prefetch import PrefetchScheduler
+from search_cache import SearchCache
+
+RESULT = [[{'title': 'Prefetched'}], 1]
+
+@pytest.fixture
+async def prefetcher():
+    '''A prefetcher with one worker, whose searches don't finish until gate is set.'''
+    cache = SearchCache(max_bytes=100_000, ttl=60)
+    gate = asyncio.Event()
+    fetched = []
+
+    async def fetch(query, page, limit):
+        fetched.append((query, page))
+        await gate.wait()
+        cache.store(query, page, limit, RESULT)
+
+    scheduler = PrefetchScheduler(fetch, cache, max_pending=2, workers=1, max_age=60)
+    scheduler.gate, scheduler.fetched = gate, fetched
+    yield scheduler
+    await scheduler.stop()
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+@pytest.mark.anyio
+async def test_runs_a_search_in_the_background(prefetcher):
+    prefetcher.schedule('hobbit', 2, 10)
+    prefetcher.gate.set()
+    await settle()
+    assert prefetcher.fetched == [('hobbit', 2)]
+    assert prefetcher.cache.has('hobbit', 2, 10)
+    assert prefetcher.stats()['completed'] == 1
+
+@pytest.mark.anyio
+async def test_a_search_pending_running_or_cached_is_not_queued_again(prefetcher):
+    prefetcher.cache.store('cached', 2, 10, RESULT)
+    prefetcher.schedule('cached', 2, 10)
+    prefetcher.schedule('running', 2, 10)
+    await settle()
+    prefetcher.schedule('Running ', 2, 10) # the same search, normalized
+    prefetcher.schedule('pending', 2, 10)
+    prefetcher.schedule('pending', 2, 10)
+    assert prefetcher.stats()['deduplicated'] == 3
+    assert prefetcher.stats()['pending'] == 1 and prefetcher.stats()['running'] == 1
+
+@pytest.mark.anyio
+async def test_the_oldest_pending_search_is_dropped_when_full(prefetcher):
+    prefetcher.schedule('running', 2, 10)
+    await settle()
+    for query in ('first', 'second', 'third'):
+        prefetcher.schedule(query, 2, 10)
+    assert prefetcher.stats()['dropped'] == 1
+    prefetcher.gate.set()
+    await settle()
+    assert prefetcher.fetched == [('running', 2), ('second', 2), ('third', 2)]
+
+@pytest.mark.anyio
+async def test_searches_waiting_longer_than_max_age_are_dropped(prefetcher):
+    prefetcher.schedule('running', 2, 10)
+    await settle()
+    prefetcher.max_age = 0.001
+    prefetcher.schedule('stale', 2, 10)
+    await asyncio.sleep(0.01)
+    prefetcher.gate.set()
+    await settle()
+    assert prefetcher.fetched == [('running', 2)]
+    assert prefetcher.stats()['dropped'] == 1
+
+@pytest.mark.anyio
+async def test_a_cancelled_search_is_not_run(prefetcher):
+    prefetcher.schedule('running', 2, 10)
+    await settle()
+    prefetcher.schedule('cancelled', 2, 10)
+    prefetcher.cancel('cancelled', 2, 10)
+    prefetcher.cancel('never scheduled', 2, 10)
+    prefetcher.gate.set()
+    await settle()
+    assert prefetcher.fetched == [('running', 2)]
+    assert prefetcher.stats()['cancelled'] == 1
@@ -0,0 +1,41 @@
+import importlib.util
+import json
+from pathlib import Path
+
+from prompt import book_payload, canonical_formats, count_tokens
+
+def lord_of_the_rings() -> dict:
+    '''The Lord of the Rings, as OpenLibrary's search returned it, from the Flask app's sample data.'''
+    path = Path(__file__).parents[2] / 'book-search' / 'app' / 'sample_data.py'
+    spec = importlib.util.spec_from_file_location('sample_data', path)
+    sample_data = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(sample_data)
+    return next(doc for search in sample_data.book_data for doc in json.loads(search)['docs']
+                if doc['title'] == 'The Lord of the Rings')
+
+def test_formats_are_normalized_and_deduplicated():
+    formats = lord_of_the_rings()['format']
+    canonical = canonical_formats(formats)
+    assert len(canonical) < len(formats)
+    assert len(set(canonical)) == len(canonical)
+    assert all(f == f.casefold() and f == f.strip() and not set('[]()/') & set(f) for f in canonical)
+    assert canonical.index('paperback') < canonical.index('hardcover') # in order of first appearance
+    assert canonical_formats(['Paperback', 'paperback', '[Paperback] /', 'Tapa dura (hardcover)', 'Unknown Binding']) == \
+        ['paperback', 'tapa dura hardcover']
+
+def test_payload_has_only_the_useful_fields_in_compact_json():
+    lotr = lord_of_the_rings()
+    book = {'title': lotr['title'], 'authors': lotr['author_name'], 'formats': lotr['format'],
+            'publish_year': lotr['first_publish_year'], 'isbn': lotr['isbn'][0], 'cover_url': 'https://example.com'}
+    payload = book_payload(book, max_list_items=3)
+    assert json.loads(payload) == {'title': 'The Lord of the Rings', 'authors': lotr['author_name'][:3],
+                                   'formats': canonical_formats(lotr['format'])[:3],
+                                   'publish_year': lotr['first_publish_year']}
+    assert payload == json.dumps(json.loads(payload), sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    assert count_tokens(payload) < count_tokens(json.dumps(book, indent=2)) / 3
+
+def test_count_tokens():
+    assert count_tokens('') == 0
+    assert count_tokens('The Lord of the Rings.') == 6
+    assert count_tokens('{"a":1}') == 7
+    assert count_tokens('extraordinarily') == 3 # one token per four characters of a long word
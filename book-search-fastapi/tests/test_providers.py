@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+from providers import Completion, LocalProvider, SummaryProvider, get_provider
+
+def test_an_incomplete_provider_cannot_be_made():
+    class CompleteOnly(SummaryProvider):
+        async def complete(self, messages):
+            return Completion('')
+
+    with pytest.raises(TypeError):
+        CompleteOnly('model')
+
+def test_local_models_get_the_local_provider():
+    assert isinstance(get_provider('local'), LocalProvider)
+    assert get_provider('local') is get_provider('local')
+
+@pytest.mark.anyio
+async def test_local_provider_summarizes_a_book():
+    messages = [{'role': 'user', 'content': json.dumps({'title': 'Beloved', 'authors': ['Toni Morrison']})}]
+    completion = await LocalProvider('local').complete(messages)
+    assert completion.text == 'Beloved is a book by Toni Morrison.'
+    assert completion.output_tokens == 7
+
+@pytest.mark.anyio
+async def test_local_provider_streams_the_same_text():
+    messages = [{'role': 'user', 'content': 'Summarize: ' + json.dumps({'title': 'Beloved'})}]
+    provider = LocalProvider('local')
+    pieces = [piece async for piece in provider.stream(messages)]
+    assert len(pieces) > 1
+    assert ''.join(pieces) == (await provider.complete(messages)).text
+
+@pytest.mark.anyio
+async def test_local_provider_answers_an_array_with_an_array():
+    books = [{'title': 'A', 'authors': ['X']}, {'title': 'B'}]
+    completion = await LocalProvider('local').complete([{'role': 'user', 'content': json.dumps(books)}])
+    assert json.loads(completion.text) == ['A is a book by X.', 'B is a book by an unknown author.']
@@ -0,0 +1,83 @@
+import sys
+import threading
+
+from registry import BookRegistry
+
+def make_registry(max_bytes = 1000):
+    return BookRegistry(max_bytes, sizeof=lambda value: 100, cost=lambda value: 1)
+
+def test_evicts_once_over_max_bytes():
+    registry = make_registry()
+    for i in range(15):
+        registry[i] = f'book {i}'
+    assert registry.evictions > 0
+    assert 14 in registry and 0 not in registry
+
+def test_expensive_entries_outlast_cheap_ones():
+    registry = BookRegistry(1000, sizeof=lambda value: 100, cost=lambda value: 500 if value == 'summarized' else 1)
+    registry['keep'] = 'summarized'
+    for i in range(20):
+        registry[i] = 'bare'
+    assert 'keep' in registry
+
+def test_alias_finds_the_same_value():
+    registry = make_registry()
+    registry['9780261102385'] = 'lotr'
+    registry.alias('/works/OL27448W', '9780261102385')
+    assert registry['/works/OL27448W'] == 'lotr'
+    assert len(registry) == 1
+
+def test_aliases_go_with_their_entry():
+    registry = make_registry()
+    registry['a'] = 'book'
+    registry.alias('b', 'a')
+    del registry['a']
+    assert 'b' not in registry
+
+def test_entries_read_through_aliases_are_still_evicted():
+    # reading by alias used to prioritize the alias, which the heap could never evict, so the entry lived forever.
+    registry = make_registry(2000) # room for the ten entries and their aliases
+    for i in range(10):
+        registry[i] = f'book {i}'
+        registry.alias(f'alias {i}', i)
+    for _ in range(3):
+        for i in range(10):
+            registry[f'alias {i}']
+    for i in range(10, 60):
+        registry[i] = f'book {i}'
+    assert not any(i in registry for i in range(10))
+    assert not any(f'alias {i}' in registry for i in range(10))
+
+def test_refresh_remeasures():
+    sizes = {'book': 100}
+    registry = BookRegistry(1000, sizeof=lambda value: sizes[value], cost=lambda value: 1)
+    registry['a'] = 'book'
+    sizes['book'] = 300
+    registry.refresh('a')
+    assert registry.bytes == 300
+
+def test_safe_to_share_between_threads():
+    registry = make_registry(max_bytes=2000)
+    errors = []
+
+    def hammer(thread: int):
+        try:
+            for i in range(2000):
+                key = (thread, i % 50)
+                registry[key] = f'book {key}'
+                registry.alias(('alias', key), key)
+                registry.get(('alias', (thread, (i * 7) % 50)))
+                if i % 10 == 0:
+                    registry.refresh(key)
+                    list(registry)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=hammer, args=(t,)) for t in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert registry.bytes == sum(entry[1] for entry in registry._entries.values()) + \
+        sum(sys.getsizeof(alias) for alias in registry._aliases)
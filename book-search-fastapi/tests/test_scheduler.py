@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from scheduler import PREFETCH, VISIBLE, WARMING, SummaryScheduler
+
+@pytest.mark.anyio
+async def test_waiting_work_runs_by_priority_then_fairly_across_users():
+    scheduler = SummaryScheduler(limit=1)
+    started = []
+
+    async def job(name, priority, user):
+        async with scheduler.slot(priority, user):
+            started.append(name)
+
+    holder = asyncio.Event()
+
+    async def hold():
+        async with scheduler.slot(VISIBLE, 'holder'):
+            await holder.wait()
+
+    jobs = [asyncio.ensure_future(hold())]
+    await asyncio.sleep(0)
+    for name, priority, user in [('warm', WARMING, 'a'), ('a1', VISIBLE, 'a'), ('a2', VISIBLE, 'a'),
+                                 ('a3', VISIBLE, 'a'), ('next', PREFETCH, 'b'), ('b1', VISIBLE, 'b')]:
+        jobs.append(asyncio.ensure_future(job(name, priority, user)))
+        await asyncio.sleep(0)
+    assert scheduler.stats()['queued'] == {'visible': 4, 'prefetch': 1, 'warming': 1}
+    holder.set()
+    await asyncio.gather(*jobs)
+    assert started == ['a1', 'b1', 'a2', 'a3', 'next', 'warm']
+
+@pytest.mark.anyio
+async def test_never_more_than_the_limit_at_once():
+    scheduler = SummaryScheduler(limit=2)
+    running = []
+
+    async def job():
+        async with scheduler.slot(VISIBLE, None):
+            running.append(scheduler.running)
+            await asyncio.sleep(0.001)
+
+    await asyncio.gather(*[job() for _ in range(10)])
+    assert max(running) == 2
+    assert scheduler.running == 0
+
+@pytest.mark.anyio
+async def test_raising_the_limit_starts_waiting_work():
+    scheduler = SummaryScheduler(limit=0)
+    started = asyncio.Event()
+
+    async def job():
+        async with scheduler.slot(VISIBLE, None):
+            started.set()
+
+    waiting = asyncio.ensure_future(job())
+    await asyncio.sleep(0)
+    assert not started.is_set()
+    scheduler.set_limit(1)
+    await asyncio.wait_for(waiting, 1)
+    assert started.is_set() and scheduler.running == 0
+
+@pytest.mark.anyio
+async def test_cancelled_work_gives_up_its_place():
+    scheduler = SummaryScheduler(limit=0)
+    started = []
+
+    async def job(name):
+        async with scheduler.slot(VISIBLE, None):
+            started.append(name)
+
+    cancelled, kept = asyncio.ensure_future(job('cancelled')), asyncio.ensure_future(job('kept'))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    await asyncio.sleep(0)
+    scheduler.set_limit(1)
+    await asyncio.wait_for(kept, 1)
+    assert started == ['kept']
+    assert scheduler.running == 0
@@ -0,0 +1,39 @@
+from search_cache import SearchCache, normalize_query, result_size
+
+RESULT = [[{'title': 'The Hobbit'}], 1]
+
+def test_queries_differing_only_in_case_space_and_form_are_the_same():
+    assert normalize_query('  The   HOBBIT ') == normalize_query('the hobbit')
+    assert normalize_query('ﬁsh') == normalize_query('fish') # a ligature, under NFKC
+    assert normalize_query(None) == ''
+
+def test_lookup_counts_hits_and_misses():
+    cache = SearchCache(max_bytes=10_000, ttl=60)
+    assert cache.lookup('hobbit', 1, 10) is None
+    cache.store('hobbit', 1, 10, RESULT)
+    assert cache.lookup(' Hobbit ', 1, 10) == RESULT
+    assert cache.lookup('hobbit', 2, 10) is None # another page
+    assert cache.has('HOBBIT', 1, 10)
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 2, 1)
+
+def test_bounded_by_bytes():
+    size = result_size(RESULT)
+    cache = SearchCache(max_bytes=size * 3, ttl=60)
+    for i in range(5):
+        cache.store(f'query {i}', 1, 10, RESULT)
+    assert cache.currsize <= size * 3
+    assert cache.evictions == 2
+    assert cache.has('query 4', 1, 10) and not cache.has('query 0', 1, 10)
+
+def test_a_result_too_big_to_fit_is_not_kept():
+    cache = SearchCache(max_bytes=10, ttl=60)
+    cache.store('hobbit', 1, 10, RESULT)
+    assert not cache.has('hobbit', 1, 10)
+
+def test_results_expire():
+    cache = SearchCache(max_bytes=10_000, ttl=60)
+    cache.store('hobbit', 1, 10, RESULT)
+    cache.expire(cache.timer() + 61)
+    assert not cache.has('hobbit', 1, 10)
+    assert cache.expirations == 1
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight, ThreadSingleFlight
+
+@pytest.mark.anyio
+async def test_concurrent_calls_share_one_run():
+    flight = SingleFlight()
+    runs = []
+
+    async def fetch(value):
+        runs.append(value)
+        await asyncio.sleep(0.01)
+        return value * 2
+
+    results = await asyncio.gather(*[flight.do('key', fetch, 21) for _ in range(5)])
+    assert results == [42] * 5
+    assert runs == [21]
+    assert flight.stats() == {'in_flight': 0, 'started': 1, 'coalesced': 4}
+
+@pytest.mark.anyio
+async def test_a_finished_call_is_not_reused():
+    flight = SingleFlight()
+
+    async def fetch():
+        return object()
+
+    assert await flight.do('key', fetch) is not await flight.do('key', fetch)
+
+@pytest.mark.anyio
+async def test_a_caller_giving_up_does_not_cancel_the_others():
+    flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return 'done'
+
+    impatient = asyncio.create_task(flight.do('key', fetch))
+    patient = asyncio.create_task(flight.do('key', fetch))
+    await asyncio.sleep(0)
+    impatient.cancel()
+    assert await patient == 'done'
+
+def test_threads_share_one_run():
+    flight = ThreadSingleFlight()
+    runs = []
+    results = []
+
+    def fetch():
+        runs.append(1)
+        time.sleep(0.05)
+        return 'result'
+
+    threads = [threading.Thread(target=lambda: results.append(flight.do('key', fetch))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == ['result'] * 5
+    assert len(runs) == 1
+    assert 'key' not in flight
+
+def test_threads_share_the_exception():
+    flight = ThreadSingleFlight()
+    errors = []
+
+    def fetch():
+        time.sleep(0.05)
+        raise ValueError('upstream failed')
+
+    def call():
+        try:
+            flight.do('key', fetch)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(errors) == 3
+    assert flight.stats()['started'] == 1
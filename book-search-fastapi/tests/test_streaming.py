@@ -0,0 +1,73 @@
+import asyncio
+import json
+
+import pytest
+
+import streaming
+from book import Book
+
+def parse(event: str):
+    kind, data = event.strip().split('\n')
+    return kind.removeprefix('event: '), json.loads(data.removeprefix('data: '))
+
+@pytest.fixture
+def search(monkeypatch):
+    '''Searches find three books, each already summarized, whose covers are looked up until gate is set.'''
+    gate = asyncio.Event()
+    looked_up = []
+    docs = [{'title': f'Streamed {i}', 'author_name': ['Someone'], 'isbn': [f'streamed-{id(gate)}-{i}'],
+             'summary': f'Summary {i}.'} for i in range(3)]
+
+    async def search_async(title, limit, page = 1, session = None):
+        return [docs, len(docs)]
+
+    async def cover_url_async(isbn):
+        looked_up.append(isbn)
+        await gate.wait()
+        return f'https://covers.openlibrary.org/b/isbn/{isbn}-S.jpg'
+
+    monkeypatch.setattr(streaming.book_api, 'search_async', search_async)
+    monkeypatch.setattr(streaming.book_api.prefetcher, 'schedule', lambda *args: None)
+    monkeypatch.setattr(Book.book_api, 'cover_url_async', cover_url_async)
+    return gate, looked_up
+
+@pytest.mark.anyio
+async def test_books_then_their_covers_then_done(search):
+    gate, _ = search
+    gate.set()
+    events = [parse(event) async for event in streaming.search_events('streamed', 1, 10)]
+    assert events[0][0] == 'books'
+    assert [b['title'] for b in events[0][1]['books']] == ['Streamed 0', 'Streamed 1', 'Streamed 2']
+    assert sorted(data['isbn'] for kind, data in events[1:-1] if kind == 'cover') == \
+        sorted(b['isbn'] for b in events[0][1]['books'])
+    assert events[-1] == ('done', {})
+
+@pytest.mark.anyio
+async def test_enrichment_waits_for_a_slow_client(search, monkeypatch):
+    gate, _ = search
+    monkeypatch.setattr(streaming.settings, 'stream_max_queued_events', 1)
+    gate.set()
+    events = streaming.search_events('streamed', 1, 10)
+    kind, data = parse(await anext(events))
+    books = [Book.get_by_isbn(b['isbn']) for b in data['books']]
+    await asyncio.sleep(0.05)
+    assert not any(b.fully_enriched for b in books) # still waiting to queue the second cover
+    rest = [parse(event) async for event in events]
+    assert [kind for kind, _ in rest] == ['cover', 'cover', 'cover', 'done']
+    assert all(b.fully_enriched for b in books)
+
+@pytest.mark.anyio
+async def test_a_client_going_away_cancels_its_enrichment(search):
+    gate, looked_up = search
+    events = streaming.search_events('streamed', 1, 10)
+    kind, data = parse(await anext(events))
+    waiting = asyncio.ensure_future(anext(events)) # for the first cover
+    await asyncio.sleep(0.01)
+    assert len(looked_up) == 3
+    waiting.cancel() # as when the client disconnects
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    await events.aclose()
+    gate.set()
+    await asyncio.sleep(0.01)
+    assert all(Book.get_by_isbn(b['isbn']).cover_url is None for b in data['books'])
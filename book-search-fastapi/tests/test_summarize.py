@@ -0,0 +1,76 @@
+import asyncio
+import json
+
+import pytest
+
+import summarize_api
+from book import Book, enrich_books
+from summarize_api import _parse_batch, summarize_async, summarize_batch_async, summarize_stream
+from summary_store import SummaryStore
+
+def book_json(title: str) -> str:
+    return json.dumps({'title': title, 'authors': ['Someone']})
+
+def test_parse_batch_reads_one_summary_per_book():
+    assert _parse_batch('Here you go: ["One.", " Two. "]', 2) == ['One.', 'Two.']
+
+@pytest.mark.parametrize('text', [None, 'no json here', '["One."]', '["One.", ""]', '["One.", 2]', '{"a": 1}'])
+def test_parse_batch_rejects_anything_else(text):
+    assert _parse_batch(text, 2) is None
+
+@pytest.mark.anyio
+async def test_summaries_are_stored_and_reused():
+    summary = await summarize_async(book_json('Stored'), 'local')
+    assert summary == 'Stored is a book by Someone.'
+    requests = summarize_api.prompt_stats.requests
+    assert await summarize_async(book_json('Stored'), 'local') == summary
+    assert summarize_api.prompt_stats.requests == requests
+
+@pytest.mark.anyio
+async def test_a_batch_is_one_request_stored_under_its_own_prompt():
+    jsons = [book_json(f'Batched {i}') for i in range(3)]
+    requests = summarize_api.prompt_stats.requests
+    summaries = await summarize_batch_async(jsons, 'local')
+    assert summaries == [f'Batched {i} is a book by Someone.' for i in range(3)]
+    assert summarize_api.prompt_stats.requests == requests + 1
+    store = summarize_api.summary_store
+    assert store.get(SummaryStore.key('local', summarize_api.BATCH_SUMMARY_INSTRUCTIONS, jsons[0])) == summaries[0]
+    assert store.get(SummaryStore.key('local', summarize_api.SUMMARY_INSTRUCTIONS, jsons[0])) is None
+    # ... but found by the single-book path all the same
+    assert await summarize_async(jsons[0], 'local') == summaries[0]
+    assert summarize_api.prompt_stats.requests == requests + 1
+
+@pytest.mark.anyio
+async def test_stream_yields_the_summary():
+    pieces = [piece async for piece in summarize_stream(book_json('Streamed'), 'local')]
+    assert ''.join(pieces) == 'Streamed is a book by Someone.'
+
+@pytest.mark.anyio
+async def test_enrich_books_batches_new_summaries(monkeypatch):
+    monkeypatch.setattr(summarize_api.settings, 'summary_batch_size', 4)
+    books = [Book({'title': f'Enriched {i}', 'author_name': ['Someone'], 'isbn': [f'enrich-{i}']}) for i in range(5)]
+    requests = summarize_api.prompt_stats.requests
+    counts = await enrich_books(books, ['summary'])
+    assert counts == {'summary': {'hits': 0, 'joined': 0, 'fetched': 5}}
+    assert [b.summary for b in books] == [f'Enriched {i} is a book by Someone.' for i in range(5)]
+    assert summarize_api.prompt_stats.requests == requests + 2 # a batch of 4, then 1 on its own
+
+@pytest.mark.anyio
+async def test_enrich_books_joins_a_batch_in_flight():
+    books = [Book({'title': f'Joined {i}', 'author_name': ['Someone'], 'isbn': [f'join-{i}']}) for i in range(2)]
+    first = asyncio.create_task(enrich_books(books, ['summary']))
+    while (books[0].flight_key, 'summary') not in Book.in_flight:
+        await asyncio.sleep(0)
+    counts = await enrich_books(books[:1], ['summary'])
+    await first
+    assert counts['summary']['joined'] == 1
+    assert books[0].summary == 'Joined 0 is a book by Someone.'
+
+@pytest.mark.anyio
+async def test_a_batch_counts_as_one_tuner_sample_per_book(monkeypatch):
+    samples = []
+    monkeypatch.setattr(summarize_api.settings, 'summary_autotune', True)
+    monkeypatch.setattr(summarize_api.summary_tuner, 'record', lambda latency, tokens: samples.append((latency, tokens)))
+    await summarize_batch_async([book_json(f'Tuned {i}') for i in range(3)], 'local')
+    assert len(samples) == 3
+    assert len(set(samples)) == 1
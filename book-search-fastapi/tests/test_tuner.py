@@ -0,0 +1,58 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import tuner
+from scheduler import SummaryScheduler
+from tuner import ConcurrencyTuner
+
+@pytest.fixture
+def clock(monkeypatch):
+    '''Seconds on the tuner's clock, moved on by hand.'''
+    now = [0.0]
+    monkeypatch.setattr(tuner, 'time', SimpleNamespace(monotonic=lambda: now[0], time=time.time))
+    return now
+
+def run_window(tuner, clock, latency = 1.0, tokens = 100, saturated = True):
+    tuner.scheduler.running = tuner.scheduler.limit if saturated else 0
+    for _ in range(tuner.window):
+        clock[0] += 1
+        tuner.record(latency, tokens)
+
+def make_tuner(limit = 4):
+    return ConcurrencyTuner(SummaryScheduler(limit), target_p95=5, min_limit=1, max_limit=6, window=4, hold_windows=2)
+
+def test_raises_the_limit_while_saturated_up_to_the_max(clock):
+    t = make_tuner()
+    for _ in range(4):
+        run_window(t, clock)
+    assert t.scheduler.limit == 6
+    assert [a['reason'] for a in t.adjustments] == ['saturated', 'saturated']
+
+def test_leaves_the_limit_alone_when_not_saturated(clock):
+    t = make_tuner()
+    run_window(t, clock, saturated=False)
+    assert t.scheduler.limit == 4
+    assert t.p95 == 1.0 and t.tokens_per_second == 100
+
+def test_cuts_the_limit_when_p95_is_over_target(clock):
+    t = make_tuner()
+    run_window(t, clock, latency=10)
+    assert t.scheduler.limit == 2 # floor(4 * 0.7)
+    run_window(t, clock, latency=10)
+    run_window(t, clock, latency=10)
+    assert t.scheduler.limit == 1 # and no lower than min_limit
+
+def test_undoes_an_increase_that_lowered_throughput_and_holds(clock):
+    t = make_tuner()
+    run_window(t, clock, tokens=100)
+    assert t.scheduler.limit == 5
+    run_window(t, clock, tokens=50)
+    assert t.scheduler.limit == 4
+    assert t.adjustments[-1]['reason'] == 'throughput fell after increase'
+    run_window(t, clock, tokens=50)
+    run_window(t, clock, tokens=50)
+    assert t.scheduler.limit == 4 # held for hold_windows
+    run_window(t, clock, tokens=50)
+    assert t.scheduler.limit == 5
@@ -0,0 +1,81 @@
+import math
+import time
+from collections import deque
+
+from scheduler import SummaryScheduler
+
+class ConcurrencyTuner:
+    '''Finds the number of concurrent generations that gets the most out of the LLM backend, by adjusting a
+       SummaryScheduler's limit as it measures the generations that run under it (AIMD).
+
+       After every `window` generations it looks at their p95 latency and the aggregate tokens/sec the backend
+       produced.  If the p95 is over target_p95 the limit is cut back multiplicatively.  Otherwise, if the scheduler
+       was actually using all its slots, the limit goes up by one, unless the last increase made throughput worse,
+       in which case it's undone and held there for a few windows before probing upwards again.'''
+
+    def __init__(self, scheduler: SummaryScheduler, target_p95: float, min_limit: int, max_limit: int,
+                 window: int = 20, decrease_factor: float = 0.7, hold_windows: int = 5):
+        self.scheduler = scheduler
+        self.target_p95 = target_p95
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.window = window
+        self.decrease_factor = decrease_factor
+        self.hold_windows = hold_windows
+        self._latencies = []
+        self._tokens = 0
+        self._saturated = 0          # generations that started with every slot in use
+        self._window_start = None
+        self._last_throughput = None
+        self._last_change = 0
+        self._hold = 0               # windows left before the limit may be raised again
+        self.p95 = None
+        self.tokens_per_second = None
+        self.adjustments = deque(maxlen=20)
+
+    def record(self, latency: float, output_tokens: int):
+        '''Note a finished generation: how long it took (not counting time queued) and how many tokens it produced.'''
+        now = time.monotonic()
+        if self._window_start is None:
+            self._window_start = now - latency
+        self._latencies.append(latency)
+        self._tokens += output_tokens or 0
+        if self.scheduler.running >= self.scheduler.limit:
+            self._saturated += 1
+        if len(self._latencies) >= self.window:
+            self._adjust(now)
+
+    def stats(self):
+        return {'limit': self.scheduler.limit,
+                'target_p95_seconds': self.target_p95,
+                'p95_seconds': self.p95,
+                'tokens_per_second': self.tokens_per_second,
+                'adjustments': list(self.adjustments)}
+
+    def _adjust(self, now: float):
+        latencies = sorted(self._latencies)
+        self.p95 = latencies[min(len(latencies) - 1, math.ceil(len(latencies) * 0.95) - 1)]
+        self.tokens_per_second = self._tokens / max(now - self._window_start, 1e-6)
+        limit = self.scheduler.limit
+        if self.p95 > self.target_p95:
+            new_limit, reason = max(self.min_limit, math.floor(limit * self.decrease_factor)), 'p95 over target'
+        elif self._last_change > 0 and self._last_throughput and self.tokens_per_second < self._last_throughput:
+            new_limit, reason = max(self.min_limit, limit - 1), 'throughput fell after increase'
+            self._hold = self.hold_windows
+        elif self._hold > 0:
+            new_limit, reason = limit, None
+            self._hold -= 1
+        elif self._saturated >= len(latencies) // 2:
+            new_limit, reason = min(self.max_limit, limit + 1), 'saturated'
+        else:
+            new_limit, reason = limit, None
+        if new_limit != limit:
+            self.scheduler.set_limit(new_limit)
+            self.adjustments.append({'at': time.time(), 'from': limit, 'to': new_limit, 'reason': reason,
+                                     'p95_seconds': self.p95, 'tokens_per_second': self.tokens_per_second})
+        self._last_change = new_limit - limit
+        self._last_throughput = self.tokens_per_second
+        self._latencies = []
+        self._tokens = 0
+        self._saturated = 0
+        self._window_start = now
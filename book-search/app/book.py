@@ -1,17 +1,44 @@
 import asyncio
 import importlib
 import json
+import sys
 
 from aiohttp import ClientSession
 
+from app.isbn import canonical_isbn
+from app.registry import BookRegistry
 from app.summarize_api import *
 
+def book_size(book) -> int:
+    '''Roughly how many bytes a book's fields take up.'''
+    size = sys.getsizeof(book.__dict__)
+    for value in book.__dict__.values():
+        size += sys.getsizeof(value)
+        if isinstance(value, list):
+            size += sum(sys.getsizeof(v) for v in value)
+    return size
+
+def book_cost(book) -> float:
+    '''How expensive a book would be to rebuild if it were dropped from the registry.  A bare search result is cheap,
+       a cover costs an upstream call, and a summary costs an LLM generation.'''
+    cost = 1
+    if book.cover_url:
+        cost += Config.COVER_REBUILD_COST
+    if book.summary:
+        cost += Config.SUMMARY_REBUILD_COST
+    return cost
+
+def isbn_key(isbn):
+    '''What books are indexed under for an ISBN: the canonical ISBN-13, if it's a valid ISBN at all.'''
+    return canonical_isbn(isbn) or isbn
+
 class Book:
 
     book_api = importlib.import_module("app.book_api") # name could be pulled from config.  A step towards dependency injection of different ways to find books.
 
-    # a cache for books.  In production, this would be something more sophisticated, like a redis cache.
-    books_by_isbn = {}
+    # a cache for books, bounded by size and keeping the ones that were most expensive to build.  In production,
+    # this would be something shared between processes, like a redis cache.
+    books_by_isbn = BookRegistry(Config.BOOK_REGISTRY_MAX_BYTES, sizeof=book_size, cost=book_cost)
 
     def __init__(self, book_dict) :
         self.authors = book_dict['author_name'] if 'author_name' in book_dict else []
@@ -21,9 +48,15 @@ class Book:
         self.formats = book_dict['format'] if 'format' in book_dict else None
         self.cover_url = book_dict['cover_url'] if 'cover_url' in book_dict else None
         self.summary = book_dict['summary'] if 'summary' in book_dict else None
+        self._work_key = book_dict['key'] if 'key' in book_dict else None # the OpenLibrary work, e.g. /works/OL27448W
         self.fully_enriched = False
         if self.isbn:
-            Book.books_by_isbn[self.isbn] = self
+            key = isbn_key(self.isbn)
+            Book.books_by_isbn[key] = self
+            for isbn in book_dict['isbn'][1:]: # so the Book is found whichever of its ISBNs is asked for
+                Book.books_by_isbn.alias(isbn_key(isbn), key)
+            if self._work_key: # every edition of the work shares this Book, and so its summary
+                Book.books_by_isbn.alias(self._work_key, key)
 
     def toJSON(self, fieldsToOmit = []):
         return json.dumps(
@@ -33,14 +66,16 @@ class Book:
         )
     
     def toDict(self, fieldsToOmit = []):
-        return dictExceptFields(self.__dict__, fieldsToOmit)
+        return dictExceptFields({k: v for k, v in self.__dict__.items() if not k.startswith('_')}, fieldsToOmit)
 
 
     def set_cover_url(self, url: str):
         self.cover_url = url
+        self.books_by_isbn.refresh(isbn_key(self.isbn))
 
     def set_summary(self, summary: str):
         self.summary = summary
+        self.books_by_isbn.refresh(isbn_key(self.isbn))
     
     def enrich_fields(self, fields: list[str]):
         asyncio.run(self.enrich_fields_async(fields))        
@@ -51,9 +86,9 @@ class Book:
     async def enrich_fields_async(self, fields = ['cover_url', 'summary']):
         fields = await self.gather_fields_async(fields)
         if fields[0] != None:
-            self.cover_url = fields[0]
+            self.set_cover_url(fields[0])
         if fields[1] != None: #this could overwrite, but that's OK. This value should be as good as the previous one.
-            self.summary = fields[1]
+            self.set_summary(fields[1])
         self.fully_enriched = len(fields) == 2 or (self.summary and self.cover_url)
 
     async def gather_fields_async(self, fields: list[str]) :
@@ -74,9 +109,25 @@ class Book:
     
     @classmethod
     def get_by_isbn(cls, isbn):
-        result = cls.books_by_isbn[isbn] if isbn in Book.books_by_isbn else None
+        '''The book with this ISBN (10 or 13, any of the book's editions), if we have it.'''
+        key = isbn_key(isbn)
+        result = cls.books_by_isbn.get(key) # not checked first, since another thread could evict it in between
         return result
 
+    @classmethod
+    def get_by_work(cls, work_key):
+        return cls.books_by_isbn.get(work_key) if work_key else None
+
+    @classmethod
+    def find(cls, book_dict):
+        '''The book we already have for a search result, whether by its work or by any of its ISBNs.'''
+        book = cls.get_by_work(book_dict.get('key'))
+        for isbn in book_dict.get('isbn', []):
+            if book:
+                break
+            book = cls.get_by_isbn(isbn)
+        return book
+
 def enrich_fields_mult(books: list[Book], fields: list[str]):
     asyncio.run(enrich_fields_books_async(books, fields))
 
@@ -93,6 +144,56 @@ async def enrich_fields_books_async(books, fields):
 
 
 
+class EnrichmentStats:
+    '''For each field asked for by /book: how often the book already had it (hits), or it had to be fetched (fetched).'''
+
+    def __init__(self):
+        self.requests = 0
+        self.counts = {}
+
+    def record(self, counts: dict):
+        self.requests += 1
+        for field, field_counts in counts.items():
+            totals = self.counts.setdefault(field, {'hits': 0, 'fetched': 0})
+            for k, v in field_counts.items():
+                totals[k] += v
+
+    def stats(self):
+        return {'requests': self.requests, **self.counts}
+
+enrichment_stats = EnrichmentStats()
+
+def enrich_books(books: list[Book], fields: list[str]) -> dict:
+    return asyncio.run(enrich_books_async(books, fields))
+
+async def enrich_books_async(books: list[Book], fields: list[str]) -> dict:
+    '''Add the requested fields to books, looking at each book once: every missing cover goes to OpenLibrary in one
+       batched request, and each missing summary is its own job.  Returns the hits and fetched counts per field.'''
+    counts = {field: {'hits': 0, 'fetched': 0} for field in fields if field in ('cover_url', 'summary')}
+    new_covers, jobs = [], []
+    for book in dict.fromkeys(books): # the same Book can be asked for under several ISBNs
+        if 'cover_url' in counts:
+            if book.cover_url != None:
+                counts['cover_url']['hits'] += 1
+            else:
+                counts['cover_url']['fetched'] += 1
+                new_covers.append(book)
+        if 'summary' in counts:
+            if book.summary != None:
+                counts['summary']['hits'] += 1
+            else:
+                counts['summary']['fetched'] += 1
+                jobs.append(add_summary_async(book))
+    if new_covers:
+        jobs.append(add_covers_to_books(new_covers))
+    async with asyncio.TaskGroup() as tg:
+        for job in jobs:
+            tg.create_task(job)
+    for book in books:
+        book.fully_enriched = bool(book.cover_url and book.summary)
+    enrichment_stats.record(counts)
+    return counts
+
 def add_covers(books: list[Book]):
     asyncio.run(add_covers_to_books(books))
 
@@ -102,7 +203,7 @@ async def add_covers_to_books(books: list[Book]):
     urls = await Book.book_api.cover_urls_async(isbns)
     for i, url in enumerate(urls):
         if filtered_books[i].cover_url == None: # just in case something else retrieved it while this was running
-            filtered_books[i].cover_url = url
+            filtered_books[i].set_cover_url(url)
 
 
 def add_summaries(books: list[Book]):
@@ -114,12 +215,12 @@ async def add_summaries_to_books(books: list[Book]):
     summaries = await summarize_multiple_async(jsons)
     for i, summary in enumerate(summaries):
         if filtered_books[i].summary == None: # just in case something else retrieved it while this was running
-            filtered_books[i].summary = summary
+            filtered_books[i].set_summary(summary)
     
 
 async def add_summary_async(book: Book):
-    summary = await summarize_async(book.toJSON(), Config.MODEL)
-    book.summary = summary
+    summary = await summarize_async(book.toJSON(['cover_url', 'summary', 'isbn']), Config.MODEL) # the omitted fields just produce nonsense from the LLM
+    book.set_summary(summary)
 
 
 
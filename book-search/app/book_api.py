@@ -1,28 +1,49 @@
-from threading import Lock
-from cachetools import LRUCache, cached
 import requests
 import asyncio
 from aiohttp import ClientSession
 
 from flask import current_app as app
 from app.book import Book
+from app.prefetch import PrefetchScheduler
+from app.search_cache import SearchCache, search_key
+from app.singleflight import ThreadSingleFlight
 from config import Config
 
-@cached(cache=LRUCache(maxsize=1024, getsizeof=len), info=True, lock=Lock())
+# results of searches, so repeated (or only trivially different) queries never go back to OpenLibrary.
+search_cache = SearchCache(Config.SEARCH_CACHE_MAX_BYTES, Config.SEARCH_CACHE_TTL)
+# searches currently being fetched, so concurrent requests for one share the call to OpenLibrary.
+searches_in_flight = ThreadSingleFlight()
+
 def search(title, page = 1, limit = Config.BOOKS_PER_PAGE): 
-    fields = ['author_name', 'format', 'isbn', 'first_publish_year','title', 'first_sentence']
+    docs, numFound = search_docs(title, page, limit)
+    books = []
+    for b in docs:
+        # use cached books if we have them, since they might already be enriched.
+        books.append(Book.find(b) or Book(b))
+    return books, numFound
+
+def search_docs(title, page = 1, limit = Config.BOOKS_PER_PAGE):
+    """The search results straight from OpenLibrary (or the search cache), before they're made into Books."""
+    cached = search_cache.lookup(title, page, limit)
+    if cached:
+        return cached
+    # concurrent requests for the same (normalized) search share a single upstream request.
+    return searches_in_flight.do(search_key(title, page, limit), _fetch_search_docs, title, page, limit)
+
+def _fetch_search_docs(title, page, limit):
+    fields = ['author_name', 'format', 'isbn', 'first_publish_year','title', 'first_sentence', 'key']
     headers = {'Content-Type': 'application/json'}
     params = 'q={}&page={}&limit={}&fields={}'.format(title, page, limit, ','.join(fields))
     r = requests.get('https://openlibrary.org/search.json', params, headers=headers) 
     res = r.json()
-    books = []
-    for b in res['docs']:
-        # use cached books if we have them, since they might already be enriched.
-        if 'isbn' in b and len(b['isbn']) > 0 and Book.get_by_isbn(b['isbn'][0]):
-            books.append(Book.get_by_isbn(b['isbn'][0]))
-        else:
-            books.append(Book(b))
-    return books, res['numFound'] 
+    search_cache.store(title, page, limit, (res['docs'], res['numFound']))
+    return res['docs'], res['numFound'] 
+
+# searches run in the background, so their results are waiting in search_cache when they're wanted.
+prefetcher = PrefetchScheduler(search_docs, search_cache,
+                               max_pending=Config.PREFETCH_MAX_PENDING,
+                               workers=Config.PREFETCH_WORKERS,
+                               max_age=Config.PREFETCH_MAX_AGE)
 
 def cover_url(isbn):
     try :  
@@ -36,23 +57,35 @@ def cover_url(isbn):
 
 async def cover_url_async(isbn, session: ClientSession):
     """Given an ISBN number, fetch the URL of the cover of that book."""
+    urls = await _fetch_cover_urls([isbn], session)
+    return urls.get(isbn)
+
+async def cover_urls_async(isbns, chunk_size = Config.COVER_BATCH_SIZE, max_concurrent_chunks = Config.COVER_BATCH_CONCURRENCY): 
+    """Fetch the cover URLs for a list of ISBNs, in the same order.  The books API accepts many bibkeys per call, so the
+       ISBNs are sent in chunks of chunk_size, with at most max_concurrent_chunks requests outstanding at once."""
+    limit = asyncio.Semaphore(max_concurrent_chunks)
+    unique_isbns = list(dict.fromkeys(isbn for isbn in isbns if isbn))
+    chunks = [unique_isbns[i:i + chunk_size] for i in range(0, len(unique_isbns), chunk_size)]
+
+    async def fetch_chunk(chunk, session):
+        async with limit:
+            return await _fetch_cover_urls(chunk, session)
+
+    urls_by_isbn = {}
+    session = ClientSession() #Config.get_client_session()
+    for urls in await asyncio.gather(*[fetch_chunk(chunk, session) for chunk in chunks]):
+        urls_by_isbn.update(urls)
+    await session.close()
+    return [urls_by_isbn.get(isbn) for isbn in isbns]
+
+async def _fetch_cover_urls(isbns, session: ClientSession) -> dict:
+    """One call to the books API for all of isbns.  Returns a dict of isbn -> url (or None)."""
     try: 
-        resp = await(session.request(method='GET', url=f'https://openlibrary.org/api/books?bibkeys=ISBN:{isbn}&format=json'))
+        bibkeys = ','.join(f'ISBN:{isbn}' for isbn in isbns)
+        resp = await(session.request(method='GET', url=f'https://openlibrary.org/api/books?bibkeys={bibkeys}&format=json'))
         resp.raise_for_status()
         data = await(resp.json())
-        data = data[f'ISBN:{isbn}']
-        return data['thumbnail_url'] if 'thumbnail_url' in data else None
+        return {isbn: data.get(f'ISBN:{isbn}', {}).get('thumbnail_url') for isbn in isbns}
     except:
-        app.logger.exception(f"Exception looking for cover for {isbn}:")
-        return None
-
-async def cover_urls_async(isbns): 
-    session = ClientSession() #Config.get_client_session()
-    tasks = []
-    for isbn in isbns:
-        tasks.append(
-            cover_url_async(isbn, session)
-        )
-    result = await asyncio.gather(*tasks) 
-    await session.close()
-    return result
+        app.logger.exception(f"Exception looking for covers for {isbns}:")
+        return {}
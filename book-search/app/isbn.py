@@ -0,0 +1,22 @@
+def canonical_isbn(isbn: str) -> int:
+    '''The ISBN-13 for an ISBN-10 or ISBN-13 (hyphens and spaces allowed), as an int, or None if it isn't one,
+       including if its check digit is wrong.  Both forms of an ISBN come out the same, and an int takes about half the
+       memory of the equivalent string, which adds up when indexing the hundreds of ISBNs a popular work can have.'''
+    digits = str(isbn).replace('-', '').replace(' ', '').upper()
+    if (len(digits) == 10 and digits[:9].isdigit() and (digits[9].isdigit() or digits[9] == 'X')
+            and digits[9] == _isbn10_check_digit(digits[:9])):
+        return int(isbn10_to_13(digits))
+    if len(digits) == 13 and digits.isdigit() and digits[12] == _isbn13_check_digit(digits[:12]):
+        return int(digits)
+    return None
+
+def isbn10_to_13(isbn10: str) -> str:
+    body = '978' + isbn10[:9]
+    return body + _isbn13_check_digit(body)
+
+def _isbn13_check_digit(body: str) -> str:
+    return str((10 - sum((3 if i % 2 else 1) * int(d) for i, d in enumerate(body)) % 10) % 10)
+
+def _isbn10_check_digit(body: str) -> str:
+    check = (11 - sum((10 - i) * int(d) for i, d in enumerate(body)) % 11) % 11
+    return 'X' if check == 10 else str(check)
@@ -0,0 +1,93 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from app.search_cache import SearchCache, search_key
+
+class PrefetchScheduler:
+    '''Runs searches on background threads (e.g. for the next page of results) so they're in the search cache before
+       anyone asks for them, without holding up the response that triggered them.
+
+       Pending prefetches wait in a bounded queue, oldest first.  A search that's already cached, pending or running
+       isn't queued again; when the queue is full the oldest pending prefetch is dropped to make room, and any that
+       have waited longer than max_age seconds are dropped rather than run, since whoever wanted them has likely
+       moved on.'''
+
+    def __init__(self, fetch, cache: SearchCache, max_pending: int, workers: int, max_age: float):
+        self.fetch = fetch # function(query, page, limit), which is expected to leave its result in cache
+        self.cache = cache
+        self.max_pending = max_pending
+        self.workers = workers
+        self.max_age = max_age
+        self._pending = OrderedDict() # key -> ((query, page, limit), time queued)
+        self._running = set()
+        self._condition = threading.Condition()
+        self._threads = []
+        self.scheduled = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.cancelled = 0
+        self.completed = 0
+        self.failed = 0
+
+    def schedule(self, query: str, page: int, limit: int):
+        '''Queue a search to be run in the background.  Returns immediately.'''
+        key = search_key(query, page, limit)
+        with self._condition:
+            if key in self._pending or key in self._running or self.cache.has(query, page, limit):
+                self.deduplicated += 1
+                return
+            if not self._threads:
+                self._start()
+            while len(self._pending) >= self.max_pending:
+                self._pending.popitem(last=False)
+                self.dropped += 1
+            self._pending[key] = ((query, page, limit), time.monotonic())
+            self.scheduled += 1
+            self._condition.notify()
+
+    def cancel(self, query: str, page: int, limit: int):
+        '''Forget a pending prefetch, e.g. because the search is now being run for real.'''
+        with self._condition:
+            if self._pending.pop(search_key(query, page, limit), None):
+                self.cancelled += 1
+
+    def stats(self):
+        with self._condition:
+            return {'pending': len(self._pending),
+                    'running': len(self._running),
+                    'scheduled': self.scheduled,
+                    'deduplicated': self.deduplicated,
+                    'dropped': self.dropped,
+                    'cancelled': self.cancelled,
+                    'completed': self.completed,
+                    'failed': self.failed}
+
+    def _start(self):
+        self._threads = [threading.Thread(target=self._work, name=f'prefetch-{i}', daemon=True) for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                key, (args, queued) = self._pending.popitem(last=False)
+                if time.monotonic() - queued > self.max_age:
+                    self.dropped += 1
+                    continue
+                self._running.add(key)
+            try:
+                self.fetch(*args)
+                succeeded = True
+            except Exception:
+                succeeded = False
+                logging.exception(f'Prefetch of {args} failed:')
+            with self._condition:
+                self._running.discard(key)
+                if succeeded:
+                    self.completed += 1
+                else:
+                    self.failed += 1
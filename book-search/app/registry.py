@@ -0,0 +1,121 @@
+import heapq
+import itertools
+import sys
+import threading
+from collections.abc import MutableMapping
+
+class BookRegistry(MutableMapping):
+    '''A bounded key -> book mapping.  It keeps a running total of roughly how many bytes its entries hold, and once
+       that passes max_bytes it evicts using GreedyDual-Size: an entry's priority is the clock (the priority of the last
+       eviction) plus its rebuild cost per byte, refreshed whenever it is used.  So large entries that are cheap to
+       rebuild (bare search results) go well before small, expensive ones (books with an LLM summary), and anything
+       unused long enough eventually ages out.
+
+       sizeof(value) and cost(value) are supplied by the caller.  Call refresh(key) after changing a value in a way that
+       alters its size or cost.
+
+       An entry can also be given aliases: other keys that find the same value, and that go when it goes.
+
+       It's safe to use from several threads (the Flask app serves from many), though sizeof and cost are then called
+       with its lock held.'''
+
+    def __init__(self, max_bytes: int, sizeof, cost):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.cost = cost
+        self._entries = {}   # key -> [priority, size, serial, value]
+        self._aliases = {}   # alias -> key
+        self._aliases_of = {} # key -> aliases
+        self._heap = []      # (priority, serial, key); superseded rows are skipped when popped
+        self._serial = itertools.count()
+        self._clock = 0.0
+        self.bytes = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.evicted_cost = 0.0
+        self._lock = threading.RLock() # reentrant, since evicting deletes entries from under __setitem__
+
+    def __getitem__(self, key):
+        with self._lock:
+            key = self._aliases.get(key, key) # the heap only knows entries by their own key, so use that, not the alias
+            entry = self._entries[key]
+            self._prioritize(key, entry)
+            return entry[3]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries[key][1]
+            size = max(1, self.sizeof(value))
+            entry = [0.0, size, 0, value]
+            self._entries[key] = entry
+            self.bytes += size
+            self._prioritize(key, entry)
+            self._evict()
+
+    def __delitem__(self, key):
+        with self._lock:
+            entry = self._entries.pop(key)
+            self.bytes -= entry[1]
+            for alias in self._aliases_of.pop(key, []):
+                if self._aliases.get(alias) == key:
+                    del self._aliases[alias]
+                    self.bytes -= sys.getsizeof(alias)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries or key in self._aliases
+
+    def __iter__(self):
+        with self._lock: # a copy, so other threads can change the registry while it's iterated
+            return iter(list(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def alias(self, alias, key):
+        '''Make alias another way to find the value stored under key.'''
+        with self._lock:
+            if key in self._entries and alias != key and self._aliases.get(alias) != key:
+                if alias not in self._aliases:
+                    self.bytes += sys.getsizeof(alias)
+                self._aliases[alias] = key
+                self._aliases_of.setdefault(key, []).append(alias)
+
+    def refresh(self, key):
+        '''Re-measure the size and cost of the value stored under key.'''
+        with self._lock:
+            if key in self._entries:
+                self[key] = self._entries[key][3]
+
+    def stats(self):
+        return {'entries': len(self._entries),
+                'aliases': len(self._aliases),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+                'evicted_bytes': self.evicted_bytes,
+                'evicted_cost': self.evicted_cost}
+
+    def _prioritize(self, key, entry):
+        entry[0] = self._clock + self.cost(entry[3]) / entry[1]
+        entry[2] = next(self._serial)
+        heapq.heappush(self._heap, (entry[0], entry[2], key))
+        if len(self._heap) > 4 * len(self._entries) + 64:
+            self._compact()
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and self._heap:
+            priority, serial, key = heapq.heappop(self._heap)
+            entry = self._entries.get(key)
+            if entry is None or entry[2] != serial:
+                continue
+            self._clock = priority
+            del self[key]
+            self.evictions += 1
+            self.evicted_bytes += entry[1]
+            self.evicted_cost += self.cost(entry[3])
+
+    def _compact(self):
+        self._heap = [(entry[0], entry[2], key) for key, entry in self._entries.items()]
+        heapq.heapify(self._heap)
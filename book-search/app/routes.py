@@ -1,8 +1,7 @@
 import json
-import concurrent
 from flask import Response, jsonify, render_template, redirect, request
 from app import app, book_api
-from app.book import Book, add_covers, enrich_fields_books
+from app.book import Book, enrich_books, enrichment_stats
 
 @app.route('/')
 def index():
@@ -26,13 +25,10 @@ def search():
     title = request.args.get('title')
     page = request.args.get('page', '1')
     page = int(page) if page.isdigit() else 1
+    book_api.prefetcher.cancel(title, page, app.config['BOOKS_PER_PAGE']) # no need to prefetch what's being fetched now
     [books, total_available] = book_api.search(title, page)
-    for i, b in enumerate(books):
-        if b.isbn in Book.books_by_isbn:
-            books[i] = Book.books_by_isbn[b.isbn]
-    # Ideally, there'd a single pool, rather than this, which won't scale at all well.
-    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-        executor.submit(book_api.search, title, page + 1)
+    # start on the next page without making this response wait for it.
+    book_api.prefetcher.schedule(title, page + 1, app.config['BOOKS_PER_PAGE'])
     return jsonify({'books': [b.toDict() for b in books],
                     'total_available': total_available})
 
@@ -44,7 +40,8 @@ def book():
       - isbn: an array of ISBN numbers
         fields: list<str> a list of the fields that should be added to the standard description of each book
                 Currently, 'cover_url' and 'summary' are supported.  If 'fields' is not provided, those two
-                fields will be enriched.
+                fields will be enriched.  The X-Enrichment header says, per field, how many books already had it
+                and how many had to be fetched.
     responses:
         200:
             description: The book, with any enriched fields.
@@ -61,7 +58,7 @@ def book():
     fields= request.args.get('fields', default='["cover_url", "summary"]')
     fields = json.loads(fields)
     books = []
-    if isbn and isbn.isdigit():
+    if isbn and not isbn.startswith('['): # a single ISBN, which may be an ISBN-10 ending in X
         b = Book.get_by_isbn(isbn)
         if b:
             books.append(b)
@@ -70,9 +67,19 @@ def book():
             b = Book.get_by_isbn(isbn_num)
             if b :
                 books.append(b)
-    if fields == ['cover_url']:
-        add_covers(books)
-    else :    
-        for b in books:
-            enrich_fields_books(books, fields)
-    return jsonify( [b.toDict() for b in books] )
+    counts = enrich_books(books, fields)
+    response = jsonify( [b.toDict() for b in books] )
+    # per field, Server-Timing style, e.g. "cover_url;hits=8;fetched=2"
+    response.headers['X-Enrichment'] = ', '.join(f'{f};' + ';'.join(f'{k}={v}' for k, v in c.items())
+                                                 for f, c in counts.items())
+    return response
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Counters for the caches in front of OpenLibrary."""
+    return jsonify({'book_registry': Book.books_by_isbn.stats(),
+                    'enrichment': enrichment_stats.stats(),
+                    'search_cache': book_api.search_cache.stats(),
+                    'searches_in_flight': book_api.searches_in_flight.stats(),
+                    'prefetch': book_api.prefetcher.stats()})
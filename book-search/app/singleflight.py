@@ -0,0 +1,78 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+class SingleFlight:
+    '''Coalesces concurrent calls for the same key: the first caller starts the work, and anyone else asking for
+       that key while it's still running awaits the same result instead of starting it again.'''
+
+    def __init__(self):
+        self._calls = {} # key -> task doing the work
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn, *args):
+        '''Return the result of fn(*args), or of the call already in flight for key.'''
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        # shielded, so one caller giving up doesn't cancel the work for everyone else waiting on it.
+        return await asyncio.shield(task)
+
+    def __contains__(self, key):
+        return key in self._calls
+
+    def stats(self):
+        return {'in_flight': len(self._calls),
+                'started': self.started,
+                'coalesced': self.coalesced}
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+class ThreadSingleFlight:
+    '''The same as SingleFlight, for blocking calls made from several threads: the first thread to ask for a key does
+       the work, and any others asking for it meanwhile block until it's done and get the same result (or exception).'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {} # key -> future the other callers wait on
+        self.started = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args):
+        '''Return the result of fn(*args), or of the call already in flight for key.'''
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.started += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def __contains__(self, key):
+        return key in self._calls
+
+    def stats(self):
+        return {'in_flight': len(self._calls),
+                'started': self.started,
+                'coalesced': self.coalesced}
@@ -15,3 +15,17 @@ class Config:
     # book-search specific params
     BOOKS_PER_PAGE = 10
     MODEL = 'llama3.2'
+    # search results, keyed by normalized query.  See app/search_cache.py.
+    SEARCH_CACHE_MAX_BYTES = 32 * 1024 * 1024
+    SEARCH_CACHE_TTL = 60 * 60     # seconds
+    # next pages of search results are fetched in the background.  See app/prefetch.py.
+    PREFETCH_WORKERS = 2
+    PREFETCH_MAX_PENDING = 100
+    PREFETCH_MAX_AGE = 10          # seconds a prefetch can wait before it's considered stale
+    # the Book registry is bounded by (approximate) size, evicting the books cheapest to rebuild first.
+    BOOK_REGISTRY_MAX_BYTES = 64 * 1024 * 1024
+    COVER_REBUILD_COST = 5         # relative to a bare search result, which costs 1
+    SUMMARY_REBUILD_COST = 500
+    # cover lookups send many ISBNs per call to OpenLibrary's books API.  See book_api.cover_urls_async.
+    COVER_BATCH_SIZE = 20
+    COVER_BATCH_CONCURRENCY = 4
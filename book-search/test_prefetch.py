@@ -0,0 +1,86 @@
+import threading
+import time
+import unittest
+
+from app.prefetch import PrefetchScheduler
+from app.search_cache import SearchCache
+
+RESULT = [[{'title': 'Prefetched'}], 1]
+
+def wait_until(condition, timeout = 2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.001)
+
+class PrefetchSchedulerCase(unittest.TestCase):
+    def setUp(self):
+        # one worker, whose searches don't finish until gate is set.
+        self.cache = SearchCache(max_bytes=100_000, ttl=60)
+        self.gate = threading.Event()
+        self.fetched = []
+
+        def fetch(query, page, limit):
+            self.fetched.append((query, page))
+            self.gate.wait()
+            self.cache.store(query, page, limit, RESULT)
+
+        self.prefetcher = PrefetchScheduler(fetch, self.cache, max_pending=2, workers=1, max_age=60)
+
+    def tearDown(self):
+        self.gate.set()
+
+    def start_running(self):
+        self.prefetcher.schedule('running', 2, 10)
+        wait_until(lambda: self.prefetcher.stats()['running'] == 1)
+
+    def finish(self):
+        self.gate.set()
+        wait_until(lambda: not self.prefetcher.stats()['pending'] and not self.prefetcher.stats()['running'])
+
+    def test_runs_a_search_in_the_background(self):
+        self.prefetcher.schedule('hobbit', 2, 10)
+        self.finish()
+        self.assertEqual(self.fetched, [('hobbit', 2)])
+        self.assertTrue(self.cache.has('hobbit', 2, 10))
+        wait_until(lambda: self.prefetcher.stats()['completed'] == 1)
+
+    def test_a_search_pending_running_or_cached_is_not_queued_again(self):
+        self.cache.store('cached', 2, 10, RESULT)
+        self.prefetcher.schedule('cached', 2, 10)
+        self.start_running()
+        self.prefetcher.schedule('Running ', 2, 10) # the same search, normalized
+        self.prefetcher.schedule('pending', 2, 10)
+        self.prefetcher.schedule('pending', 2, 10)
+        stats = self.prefetcher.stats()
+        self.assertEqual((stats['deduplicated'], stats['pending'], stats['running']), (3, 1, 1))
+
+    def test_the_oldest_pending_search_is_dropped_when_full(self):
+        self.start_running()
+        for query in ('first', 'second', 'third'):
+            self.prefetcher.schedule(query, 2, 10)
+        self.assertEqual(self.prefetcher.stats()['dropped'], 1)
+        self.finish()
+        self.assertEqual(self.fetched, [('running', 2), ('second', 2), ('third', 2)])
+
+    def test_searches_waiting_longer_than_max_age_are_dropped(self):
+        self.start_running()
+        self.prefetcher.max_age = 0.001
+        self.prefetcher.schedule('stale', 2, 10)
+        time.sleep(0.01)
+        self.finish()
+        self.assertEqual(self.fetched, [('running', 2)])
+        self.assertEqual(self.prefetcher.stats()['dropped'], 1)
+
+    def test_a_cancelled_search_is_not_run(self):
+        self.start_running()
+        self.prefetcher.schedule('cancelled', 2, 10)
+        self.prefetcher.cancel('cancelled', 2, 10)
+        self.prefetcher.cancel('never scheduled', 2, 10)
+        self.finish()
+        self.assertEqual(self.fetched, [('running', 2)])
+        self.assertEqual(self.prefetcher.stats()['cancelled'], 1)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)